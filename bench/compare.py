@@ -0,0 +1,72 @@
+"""Compare two bench/run.py result files and flag regressions.
+
+    python bench/compare.py baseline.json candidate.json [--threshold 10]
+
+Exits 1 when any shared result regresses by more than the threshold (percent)
+on p95 latency or throughput, or starts returning errors.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def _change(before: float, after: float) -> float:
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> tuple:
+    rows, regressions = [], []
+    for name in sorted(set(baseline["results"]) & set(candidate["results"])):
+        before, after = baseline["results"][name], candidate["results"][name]
+        p95 = _change(before["p95_ms"], after["p95_ms"])
+        rps = _change(before["throughput_rps"], after["throughput_rps"])
+        flags = []
+        if p95 > threshold:
+            flags.append("p95")
+        # A single-sample result has no meaningful throughput
+        if before["requests"] > 1 and rps < -threshold:
+            flags.append("throughput")
+        if after["errors"] > before["errors"]:
+            flags.append("errors")
+        rows.append((name, before["p95_ms"], after["p95_ms"], p95, before["throughput_rps"], after["throughput_rps"], rps, flags))
+        if flags:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text())
+    candidate = json.loads(args.candidate.read_text())
+    rows, regressions = compare(baseline, candidate, args.threshold)
+
+    print(f"baseline  {baseline['meta']['commit']}  ({baseline['meta']['mode']}, {baseline['meta']['timestamp']})")
+    print(f"candidate {candidate['meta']['commit']}  ({candidate['meta']['mode']}, {candidate['meta']['timestamp']})")
+    print()
+    print(f"{'result':<40} {'p95 ms':>21} {'change':>8} {'req/s':>21} {'change':>8}")
+    for name, p95_before, p95_after, p95, rps_before, rps_after, rps, flags in rows:
+        marker = "  <-- " + ", ".join(flags) if flags else ""
+        print(
+            f"{name:<40} {p95_before:>10.2f}{p95_after:>11.2f} {p95:>+7.1f}%"
+            f" {rps_before:>10.2f}{rps_after:>11.2f} {rps:>+7.1f}%{marker}"
+        )
+
+    only = sorted(set(baseline["results"]) ^ set(candidate["results"]))
+    if only:
+        print(f"\nNot in both runs: {', '.join(only)}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:g}%")
+        sys.exit(1)
+    print(f"\nNo regressions over {args.threshold:g}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Synthetic fixtures: images of several megapixel sizes, multi-page PDFs, short videos."""
+import math
+import shutil
+import subprocess
+from pathlib import Path
+
+import fitz
+import pyvips
+
+
+def _pattern(width: int, height: int) -> pyvips.Image:
+    # Gradients plus noise: compresses like a photo rather than a flat colour
+    xyz = pyvips.Image.xyz(width, height)
+    x, y = xyz[0], xyz[1]
+    image = (x * 255 / width).bandjoin([y * 255 / height, (x + y) % 256])
+    noise = pyvips.Image.gaussnoise(width, height, sigma=18)
+    return (image + noise).cast("uchar").copy(interpretation="srgb")
+
+
+def make_image(dest: Path, megapixels: float, fmt: str = "jpg") -> Path:
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    image = _pattern(width, height)
+    if fmt == "png":
+        image.write_to_file(str(dest), compression=6)
+    else:
+        image.write_to_file(str(dest), Q=90)
+    return dest
+
+
+def make_pdf(dest: Path, pages: int) -> Path:
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((72, 90), f"Benchmark document - page {number + 1}", fontsize=22)
+        for line in range(40):
+            page.insert_text((72, 130 + line * 16), f"{line:02d} Lorem ipsum dolor sit amet, consectetur adipiscing elit", fontsize=10)
+        page.draw_rect(fitz.Rect(72, 780, 523, 800), color=(0.2, 0.4, 0.8), fill=(0.2, 0.4, 0.8))
+    doc.save(str(dest))
+    doc.close()
+    return dest
+
+
+def make_video(dest: Path, seconds: int, size: str = "1280x720", ffmpeg_bin: str = "ffmpeg") -> Path:
+    source = ["-f", "lavfi", "-i", f"testsrc2=duration={seconds}:size={size}:rate=25"]
+    for codec in (["-c:v", "libx264", "-pix_fmt", "yuv420p", "-g", "50"], []):
+        result = subprocess.run(
+            [ffmpeg_bin, "-hide_banner", "-loglevel", "error", *source, *codec, "-y", str(dest)],
+            capture_output=True, text=True,
+        )
+        if result.returncode == 0:
+            return dest
+    raise RuntimeError(f"ffmpeg could not generate {dest.name}: {result.stderr}")
+
+
+def build(fixtures_dir: Path, image_megapixels: list, pdf_pages: list, video_seconds: list) -> dict:
+    """Create (or reuse) every fixture and return {kind: {label: path}}."""
+    fixtures_dir.mkdir(parents=True, exist_ok=True)
+    ffmpeg_bin = shutil.which("ffmpeg") or "ffmpeg"
+    fixtures = {"image": {}, "png": {}, "pdf": {}, "video": {}}
+
+    for mp in image_megapixels:
+        label = f"{mp:g}mp"
+        for kind, ext in (("image", "jpg"), ("png", "png")):
+            path = fixtures_dir / f"image_{label}.{ext}"
+            if not path.exists():
+                make_image(path, mp, ext)
+            fixtures[kind][label] = path
+
+    for pages in pdf_pages:
+        label = f"{pages}p"
+        path = fixtures_dir / f"doc_{label}.pdf"
+        if not path.exists():
+            make_pdf(path, pages)
+        fixtures["pdf"][label] = path
+
+    for seconds in video_seconds:
+        label = f"{seconds}s"
+        path = fixtures_dir / f"video_{label}.mp4"
+        if not path.exists():
+            make_video(path, seconds, ffmpeg_bin=ffmpeg_bin)
+        fixtures["video"][label] = path
+
+    return fixtures
@@ -0,0 +1,178 @@
+"""Render the service template, run it in-process or under uvicorn, and time requests."""
+import asyncio
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+TEMPLATE = REPO_ROOT / "templates" / "main.py"
+
+PROJECT = "tixabench"
+API_KEY = "bench-key"
+BASE_URL = "http://bench.local"
+AUTH = {"x-api-key": API_KEY}
+
+
+def render_app(app_dir: Path) -> Path:
+    """Substitute the placeholders the same way core/create.sh does."""
+    app_dir.mkdir(parents=True, exist_ok=True)
+    source = TEMPLATE.read_text()
+    for placeholder, value in (("{{PROJECT}}", PROJECT), ("{{API_KEY}}", API_KEY), ("{{BASE_URL}}", BASE_URL)):
+        source = source.replace(placeholder, value)
+    target = app_dir / "main.py"
+    target.write_text(source)
+    return target
+
+
+def app_environment(data_dir: Path, workers: int, extra: dict) -> dict:
+    env = {
+        "MEDIA_BASE_PATH": str(data_dir),
+        "WEB_WORKERS": str(workers),
+        # No nginx in front: the app has to send files itself
+        "ACCEL_REDIRECT": "0",
+        "INDEX_RECONCILE_INTERVAL": "0",
+        "SERVER_TIMING": "0",
+    }
+    env.update(extra)
+    return env
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: list, errors: int, wall: float) -> dict:
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count + errors,
+        "errors": errors,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(count / wall, 2) if wall > 0 else 0.0,
+        "mean_ms": round(sum(values) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+class Target:
+    """A running app plus an httpx client pointed at it."""
+
+    def __init__(self, client: httpx.AsyncClient, mode: str):
+        self.client = client
+        self.mode = mode
+
+    async def drive(self, requests: list, concurrency: int, expect=(200,)) -> dict:
+        """Send every (method, url, kwargs) with up to `concurrency` in flight."""
+        queue = asyncio.Queue()
+        for request in requests:
+            queue.put_nowait(request)
+        latencies, errors = [], []
+
+        async def worker():
+            while True:
+                try:
+                    method, url, kwargs = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if callable(kwargs):
+                    kwargs = kwargs()
+                started = time.perf_counter()
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                    await response.aread()
+                    ok = response.status_code in expect
+                except httpx.HTTPError:
+                    ok = False
+                elapsed = time.perf_counter() - started
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(url)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        result = summarize(latencies, len(errors), time.perf_counter() - started)
+        if errors:
+            result["first_error"] = errors[0]
+        return result
+
+
+def import_app(app_dir: Path, env: dict):
+    """Import the rendered template as the ``main`` module (used for seeding and in-process runs)."""
+    os.environ.update(env)
+    if str(app_dir) not in sys.path:
+        sys.path.insert(0, str(app_dir))
+    import main
+    return main
+
+
+@contextlib.asynccontextmanager
+async def in_process(app_dir: Path, env: dict):
+    """Import the rendered app into this process and talk to it over ASGI."""
+    main = import_app(app_dir, env)
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            yield Target(client, "inprocess")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def over_uvicorn(app_dir: Path, env: dict, workers: int):
+    """Run the rendered app under a local uvicorn, as the systemd unit does."""
+    port = _free_port()
+    metrics_dir = Path(env["MEDIA_BASE_PATH"]).parent / "metrics"
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    for stale in metrics_dir.glob("*.db"):
+        stale.unlink()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--timeout-keep-alive", "75", "--log-level", "warning",
+        ],
+        cwd=app_dir,
+        env={**os.environ, **env, "PROMETHEUS_MULTIPROC_DIR": str(metrics_dir)},
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(
+            base_url=base_url, timeout=300,
+            limits=httpx.Limits(max_connections=256, max_keepalive_connections=256),
+        ) as client:
+            deadline = time.monotonic() + 60
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError("uvicorn exited during startup")
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not become healthy within 60s")
+                await asyncio.sleep(0.2)
+            yield Target(client, "uvicorn")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
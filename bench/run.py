@@ -0,0 +1,160 @@
+"""Benchmark the media service and write machine-readable results.
+
+    python bench/run.py                          # everything, in-process
+    python bench/run.py --mode uvicorn --workers 4
+    python bench/run.py --scenarios cold,warm --quick --out results/before.json
+    python bench/compare.py results/before.json results/after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixtures  # noqa: E402
+import harness  # noqa: E402
+import seed  # noqa: E402
+from scenarios import SCENARIOS  # noqa: E402
+
+FULL = {
+    "image_megapixels": [1, 6, 24],
+    "pdf_pages": [3, 40],
+    "video_seconds": [10, 120],
+    "list_counts": [1_000, 10_000, 100_000],
+    "delete_originals": 200,
+    "delete_per_original": 20,
+    "delete_background_entries": 100_000,
+}
+QUICK = {
+    "image_megapixels": [1, 6],
+    "pdf_pages": [3],
+    "video_seconds": [5],
+    "list_counts": [1_000, 10_000],
+    "delete_originals": 50,
+    "delete_per_original": 10,
+    "delete_background_entries": 10_000,
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=harness.REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated: {','.join(SCENARIOS)}")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (WEB_WORKERS)")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--iterations", type=int, default=40, help="base request count per scenario")
+    parser.add_argument("--quick", action="store_true", help="smaller fixtures and data sets")
+    parser.add_argument("--workdir", type=Path, help="keep data here (default: a temp dir, removed afterwards)")
+    parser.add_argument("--fixtures", type=Path, help="fixture cache dir (default: <workdir>/fixtures)")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra app environment")
+    parser.add_argument("--out", type=Path, help="write results JSON here (default: stdout)")
+    return parser.parse_args()
+
+
+async def run(args, workdir: Path) -> dict:
+    sizes = QUICK if args.quick else FULL
+    scenario_names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenario_names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    app_dir = workdir / "app"
+    data_dir = workdir / "data"
+    if data_dir.exists():
+        shutil.rmtree(data_dir)
+    harness.render_app(app_dir)
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    env = harness.app_environment(data_dir, args.workers, extra_env)
+
+    print("Building fixtures...", file=sys.stderr)
+    ctx = {
+        "fixtures": fixtures.build(
+            args.fixtures or workdir / "fixtures",
+            sizes["image_megapixels"], sizes["pdf_pages"], sizes["video_seconds"],
+        ),
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+    }
+
+    main = harness.import_app(app_dir, env)
+    setup = {}
+    if "list" in scenario_names:
+        print("Seeding listing sections...", file=sys.stderr)
+        ctx["listing"] = seed.seed_listing(main, sizes["list_counts"])
+        setup["listing"] = ctx["listing"]
+    if "delete" in scenario_names:
+        print("Seeding delete targets and cache...", file=sys.stderr)
+        ctx["delete"] = seed.seed_delete(
+            main, sizes["delete_originals"], sizes["delete_per_original"], sizes["delete_background_entries"],
+        )
+        setup["delete"] = {k: v for k, v in ctx["delete"].items() if k != "targets"}
+
+    if args.mode == "uvicorn":
+        target_cm = harness.over_uvicorn(app_dir, env, args.workers)
+    else:
+        target_cm = harness.in_process(app_dir, env)
+
+    results = {}
+    async with target_cm as target:
+        for name in scenario_names:
+            print(f"Running {name}...", file=sys.stderr)
+            results.update(await SCENARIOS[name](target, ctx))
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git_commit(),
+            "mode": args.mode,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "quick": args.quick,
+            "scenarios": scenario_names,
+            "env": extra_env,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "setup": setup,
+        },
+        "results": results,
+    }
+
+
+def main():
+    args = parse_args()
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="tixa-bench-"))
+    try:
+        report = asyncio.run(run(args, workdir))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(output + "\n")
+        print(f"Results written to {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Benchmark scenarios. Each takes (target, ctx) and returns {result name: summary}."""
+import time
+from urllib.parse import quote
+
+from harness import AUTH, summarize
+
+
+async def _upload(target, section: str, path) -> dict:
+    with open(path, "rb") as fh:
+        response = await target.client.post(
+            f"/upload/{section}", files={"file": (path.name, fh.read())}, headers=AUTH,
+            params={"pregenerate": "false"},
+        )
+    response.raise_for_status()
+    return response.json()
+
+
+async def _originals(target, ctx, section: str) -> dict:
+    """Upload each fixture once (untimed); returns {(kind, label): relative path}."""
+    uploaded = ctx.setdefault("uploaded", {})
+    for kind, fixtures in ctx["fixtures"].items():
+        if kind == "png":
+            continue
+        for label, path in fixtures.items():
+            if (kind, label) not in uploaded:
+                body = await _upload(target, section, path)
+                uploaded[(kind, label)] = quote(f"{section}/{body['file_name']}")
+    return uploaded
+
+
+def _cold_url(kind: str, rel: str, i: int) -> str:
+    # A size nobody asked for before, so every request is a cache miss
+    if kind == "image":
+        return f"/process/{200 + i}/0/{rel}"
+    if kind == "pdf":
+        return f"/process/pdf/thumbnail/{120 + i}x{160 + i}/{rel}"
+    return f"/process/video/thumbnail/{160 + i}x{90 + i}/{rel}"
+
+
+def _warm_url(kind: str, rel: str) -> str:
+    if kind == "image":
+        return f"/process/300/300/{rel}"
+    if kind == "pdf":
+        return f"/process/pdf/thumbnail/300x300/{rel}"
+    return f"/process/video/thumbnail/300x300/{rel}"
+
+
+async def cold_render(target, ctx) -> dict:
+    uploaded = await _originals(target, ctx, "benchrender")
+    results = {}
+    offset = ctx.setdefault("cold_offset", 0)
+    for (kind, label), rel in uploaded.items():
+        count = ctx["iterations"] if kind == "image" else max(4, ctx["iterations"] // 4)
+        requests = [("GET", _cold_url(kind, rel, offset + i), {}) for i in range(count)]
+        results[f"cold_{kind}_{label}"] = await target.drive(requests, ctx["concurrency"])
+    ctx["cold_offset"] = offset + ctx["iterations"]
+    return results
+
+
+async def warm_hit(target, ctx) -> dict:
+    uploaded = await _originals(target, ctx, "benchrender")
+    results = {}
+    for (kind, label), rel in uploaded.items():
+        url = _warm_url(kind, rel)
+        primed = await target.client.get(url)
+        primed.raise_for_status()
+        count = ctx["iterations"] * 5
+        results[f"warm_{kind}_{label}"] = await target.drive([("GET", url, {})] * count, ctx["concurrency"])
+
+        etag = primed.headers.get("etag")
+        if etag:
+            results[f"revalidate_{kind}_{label}"] = await target.drive(
+                [("GET", url, {"headers": {"If-None-Match": etag}})] * count, ctx["concurrency"], expect=(304,),
+            )
+    return results
+
+
+async def upload(target, ctx) -> dict:
+    results = {}
+    for kind in ("image", "png", "pdf", "video"):
+        for label, path in ctx["fixtures"][kind].items():
+            payload = path.read_bytes()
+
+            def upload_kwargs(payload=payload, name=path.name):
+                return {"files": {"file": (name, payload)}, "headers": AUTH, "params": {"pregenerate": "false"}}
+
+            requests = [("POST", "/upload/benchupload", upload_kwargs)] * max(4, ctx["iterations"] // 2)
+            result = await target.drive(requests, ctx["concurrency"])
+            result["bytes"] = len(payload)
+            result["mb_per_s"] = round(len(payload) * result["throughput_rps"] / (1024 * 1024), 2)
+            results[f"upload_{kind}_{label}"] = result
+    return results
+
+
+async def listing(target, ctx) -> dict:
+    results = {}
+    for count, info in ctx["listing"].items():
+        section = info["section"]
+        requests = [("GET", f"/list/{section}", {"headers": AUTH, "params": {"limit": 50}})] * ctx["iterations"]
+        results[f"list_{count}_first_page"] = await target.drive(requests, ctx["concurrency"])
+
+        deep_page = max(1, count // 50 // 2)
+        requests = [
+            ("GET", f"/list/{section}", {"headers": AUTH, "params": {"limit": 50, "page": deep_page}})
+        ] * ctx["iterations"]
+        results[f"list_{count}_deep_offset"] = await target.drive(requests, ctx["concurrency"])
+
+        # Keyset pagination is inherently sequential
+        latencies, errors, cursor = [], 0, None
+        started = time.perf_counter()
+        for _ in range(min(ctx["iterations"], max(1, count // 50))):
+            params = {"limit": 50, **({"cursor": cursor} if cursor else {})}
+            request_started = time.perf_counter()
+            response = await target.client.get(f"/list/{section}", headers=AUTH, params=params)
+            if response.status_code != 200:
+                errors += 1
+                break
+            latencies.append(time.perf_counter() - request_started)
+            cursor = response.json().get("next_cursor")
+            if not cursor:
+                break
+        results[f"list_{count}_cursor_walk"] = summarize(latencies, errors, time.perf_counter() - started)
+    return results
+
+
+async def delete(target, ctx) -> dict:
+    info = ctx["delete"]
+    requests = [("DELETE", f"/delete/{quote(rel)}", {"headers": AUTH}) for rel in info["targets"]]
+    result = await target.drive(requests, ctx["concurrency"])
+    result["cache_entries"] = info["cache_entries"]
+    results = {"delete_single_large_cache": result}
+
+    started = time.perf_counter()
+    response = await target.client.delete(f"/delete/{info['prefix']}", headers=AUTH, params={"prefix": "true"})
+    elapsed = time.perf_counter() - started
+    result = summarize([elapsed] if response.status_code == 200 else [], int(response.status_code != 200), elapsed)
+    if response.status_code == 200:
+        result["deleted_cache_files"] = response.json().get("deleted_cache_files")
+    results["delete_prefix_large_cache"] = result
+    return results
+
+
+SCENARIOS = {
+    "cold": cold_render,
+    "warm": warm_hit,
+    "upload": upload,
+    "list": listing,
+    "delete": delete,
+}
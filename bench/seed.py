@@ -0,0 +1,93 @@
+"""Pre-populate originals, the asset index and the derivative manifest before the app starts.
+
+Seeding goes through the rendered app's own index helpers, with real files on
+disk whose size/mtime match the rows, so the startup reconcile leaves them alone.
+"""
+import time
+from pathlib import Path
+
+import pyvips
+
+TINY_JPEG_SIZE = 16
+
+
+def _tiny_jpeg() -> bytes:
+    return pyvips.Image.black(TINY_JPEG_SIZE, TINY_JPEG_SIZE, bands=3).jpegsave_buffer(Q=80)
+
+
+def _write_originals(main, section: str, count: int, payload: bytes) -> list:
+    section_dir = main.ORIGINALS_DIR / section
+    section_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for number in range(count):
+        path = section_dir / f"{number:07d}_seed.jpg"
+        path.write_bytes(payload)
+        paths.append(path)
+    return paths
+
+
+def _index(main, paths: list) -> None:
+    meta = {"width": TINY_JPEG_SIZE, "height": TINY_JPEG_SIZE, "format": "uchar", "bands": 3}
+    conn = main._db()
+    conn.execute("BEGIN")
+    try:
+        for path in paths:
+            main._index_upsert(main._original_rel_path(path), "image", path.stat(), meta, None)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def seed_listing(main, counts: list) -> dict:
+    """One section per count ("list1000", ...) holding that many indexed originals."""
+    payload = _tiny_jpeg()
+    sections = {}
+    for count in counts:
+        section = f"list{count}"
+        started = time.perf_counter()
+        _index(main, _write_originals(main, section, count, payload))
+        sections[count] = {"section": section, "seed_s": round(time.perf_counter() - started, 2)}
+    return sections
+
+
+def _write_derivatives(main, original: Path, per_original: int, payload: bytes) -> None:
+    rel_path = main._original_rel_path(original)
+    for number in range(per_original):
+        cache_path = main._processed_cache_path(rel_path, 100 + number, 0, 80, "webp")
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_bytes(payload)
+        main._record_derivative(cache_path, rel_path, "process")
+
+
+def seed_delete(main, originals: int, per_original: int, background_entries: int) -> dict:
+    """Originals with recorded derivatives to delete, inside a large unrelated cache.
+
+    "deletes" holds the per-asset targets, "deleteprefix" a whole section for a
+    prefix delete, and "cachefill" only exists to make the cache big.
+    """
+    payload = _tiny_jpeg()
+    started = time.perf_counter()
+    targets = _write_originals(main, "deletes", originals, payload)
+    prefix_targets = _write_originals(main, "deleteprefix", originals, payload)
+    fill_originals = _write_originals(main, "cachefill", max(1, background_entries // 50), payload)
+    _index(main, targets + prefix_targets + fill_originals)
+
+    conn = main._db()
+    conn.execute("BEGIN")
+    try:
+        for original in targets + prefix_targets:
+            _write_derivatives(main, original, per_original, payload)
+        for original in fill_originals:
+            _write_derivatives(main, original, 50, payload)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    return {
+        "targets": [main._original_rel_path(path) for path in targets],
+        "prefix": "deleteprefix",
+        "cache_entries": (len(targets) + len(prefix_targets)) * per_original + len(fill_originals) * 50,
+        "seed_s": round(time.perf_counter() - started, 2),
+    }
@@ -20,6 +20,22 @@ fail() {
   exit 1
 }
 
+# -------------------------------------------------
+# Options (prompted for when not given)
+# -------------------------------------------------
+WORKERS=""
+RENDER_CONCURRENCY=""
+UPLOAD_CONCURRENCY=""
+
+while [ $# -gt 0 ]; do
+  case "$1" in
+    --workers) WORKERS="$2"; shift 2 ;;
+    --render-concurrency) RENDER_CONCURRENCY="$2"; shift 2 ;;
+    --upload-concurrency) UPLOAD_CONCURRENCY="$2"; shift 2 ;;
+    *) fail "Unknown option: $1" ;;
+  esac
+done
+
 # -------------------------------------------------
 # Startup checks
 # -------------------------------------------------
@@ -47,6 +63,26 @@ read -p "Domain (e.g. img.example.com): " DOMAIN
 [ -z "$PROJECT" ] && fail "Project name cannot be empty"
 [ -z "$DOMAIN" ] && fail "Domain cannot be empty"
 
+CPU_CORES=$(nproc 2>/dev/null || echo 1)
+
+if [ -z "$WORKERS" ]; then
+  read -p "Worker processes [$CPU_CORES]: " WORKERS
+fi
+if [ -z "$RENDER_CONCURRENCY" ]; then
+  read -p "Concurrent renders (all workers) [$CPU_CORES]: " RENDER_CONCURRENCY
+fi
+if [ -z "$UPLOAD_CONCURRENCY" ]; then
+  read -p "Concurrent uploads per worker [4]: " UPLOAD_CONCURRENCY
+fi
+
+WORKERS="${WORKERS:-$CPU_CORES}"
+RENDER_CONCURRENCY="${RENDER_CONCURRENCY:-$CPU_CORES}"
+UPLOAD_CONCURRENCY="${UPLOAD_CONCURRENCY:-4}"
+
+for VALUE in "$WORKERS" "$RENDER_CONCURRENCY" "$UPLOAD_CONCURRENCY"; do
+  [[ "$VALUE" =~ ^[1-9][0-9]*$ ]] || fail "Concurrency settings must be positive numbers"
+done
+
 PROJECT_LOWER="${PROJECT,,}"
 
 # -------------------------------------------------
@@ -108,6 +144,9 @@ echo "--------------------------------"
 echo "Project : $PROJECT_LOWER"
 echo "Domain  : $DOMAIN"
 echo "Port    : $PORT"
+echo "Workers : $WORKERS"
+echo "Renders : $RENDER_CONCURRENCY"
+echo "Uploads : $UPLOAD_CONCURRENCY per worker"
 echo "API Key : $API_KEY"
 echo "--------------------------------"
 echo ""
@@ -132,7 +171,7 @@ python3 -m venv "/opt/${PROJECT_LOWER}-processor/venv"
 source "/opt/${PROJECT_LOWER}-processor/venv/bin/activate"
 
 pip install --upgrade pip
-pip install fastapi uvicorn python-multipart pyvips pillow pymupdf python-magic aiofiles
+pip install fastapi uvicorn python-multipart pyvips pillow pymupdf python-magic aiofiles prometheus-client
 
 deactivate
 
@@ -151,6 +190,9 @@ echo "▶ Creating systemd service"
 sed \
   -e "s/{{PROJECT}}/${PROJECT_LOWER}/g" \
   -e "s/{{PORT}}/${PORT}/g" \
+  -e "s/{{WORKERS}}/${WORKERS}/g" \
+  -e "s/{{RENDER_CONCURRENCY}}/${RENDER_CONCURRENCY}/g" \
+  -e "s/{{UPLOAD_CONCURRENCY}}/${UPLOAD_CONCURRENCY}/g" \
   "$BASE_DIR/templates/service.tpl" \
   > "/etc/systemd/system/${PROJECT_LOWER}-processor.service"
 
@@ -163,6 +205,9 @@ systemctl start "${PROJECT_LOWER}-processor"
 # -------------------------------------------------
 echo "▶ Creating nginx config"
 
+# Shared query-default maps used by every service's try_files rules
+cp "$BASE_DIR/templates/nginx.maps.conf" /etc/nginx/conf.d/tixa.conf
+
 sed \
   -e "s/{{PROJECT}}/${PROJECT_LOWER}/g" \
   -e "s/{{DOMAIN}}/${DOMAIN}/g" \
@@ -219,6 +264,7 @@ jq ". + {
   \"${PROJECT_LOWER}\": {
     \"domain\": \"${DOMAIN}\",
     \"port\": ${PORT},
+    \"workers\": ${WORKERS},
     \"api_key\": \"${API_KEY}\",
     \"ssl\": \"${SSL_STATUS}\"
   }
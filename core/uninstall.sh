@@ -34,6 +34,11 @@ if [ "$MODE" == "--hard" ]; then
     done
   fi
 
+  echo ""
+  echo "▶ Removing shared nginx config"
+  rm -f /etc/nginx/conf.d/tixa.conf
+  systemctl reload nginx || true
+
   echo ""
   echo "▶ Removing state directory"
   rm -rf "$STATE_DIR"
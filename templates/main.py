@@ -1,6 +1,11 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Query
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Query, Body
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
+from starlette.routing import Match
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
 import pyvips
 import subprocess
 import uuid
@@ -8,13 +13,29 @@ import os
 import shutil
 import tempfile
 from pathlib import Path
-from urllib.parse import quote, unquote
+from urllib.parse import quote, unquote, urlsplit, urlencode, parse_qsl
 from typing import Optional
 import mimetypes
 import fitz  # PyMuPDF for PDF processing
-from PIL import Image as PILImage
-import io
 import json
+import re
+import asyncio
+import time
+import functools
+import multiprocessing
+import hashlib
+import html
+import math
+import fcntl
+import aiofiles
+import sqlite3
+import threading
+import base64
+import contextlib
+import contextvars
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 app = FastAPI(title="Advanced Media Processing Service")
 
@@ -22,19 +43,140 @@ app = FastAPI(title="Advanced Media Processing Service")
 # Configuration
 # ---------------------------
 PROJECT_NAME = "{{PROJECT}}"
-BASE_PATH = Path(f"/var/www/images/{PROJECT_NAME}")
+BASE_PATH = Path(os.getenv("MEDIA_BASE_PATH", f"/var/www/images/{PROJECT_NAME}"))
 ORIGINALS_DIR = BASE_PATH / "originals"
 CACHE_DIR = BASE_PATH / "cache"
 THUMBNAILS_DIR = BASE_PATH / "thumbnails"
+LOCKS_DIR = BASE_PATH / ".locks"
+OBJECTS_DIR = BASE_PATH / "objects"
+INDEX_DB_PATH = BASE_PATH / "index.sqlite3"
 
 ORIGINALS_DIR.mkdir(parents=True, exist_ok=True)
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 THUMBNAILS_DIR.mkdir(parents=True, exist_ok=True)
+LOCKS_DIR.mkdir(parents=True, exist_ok=True)
 
 # Configure via env in production
 API_KEY = "{{API_KEY}}"
 VPS_BASE_URL = "{{BASE_URL}}"
 FFMPEG_BIN_ENV = os.getenv("FFMPEG_BIN")
+FFPROBE_BIN_ENV = os.getenv("FFPROBE_BIN")
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+# Render executors: "thread" or "process" pool per job type, sized per service.
+# pyvips and ffmpeg release the GIL, PyMuPDF does not, so PDFs default to processes.
+# RENDER_CONCURRENCY is host-wide and split across the WEB_WORKERS uvicorn processes.
+CPU_COUNT = os.cpu_count() or 1
+WEB_WORKERS = max(1, _env_int("WEB_WORKERS", 1))
+RENDER_CONCURRENCY = _env_int("RENDER_CONCURRENCY", CPU_COUNT)
+RENDER_SHARE = max(1, RENDER_CONCURRENCY // WEB_WORKERS)
+RENDER_POOL_CONFIG = {
+    "image": {
+        "kind": os.getenv("RENDER_IMAGE_POOL", "thread"),
+        "workers": _env_int("RENDER_IMAGE_WORKERS", RENDER_SHARE),
+    },
+    "pdf": {
+        "kind": os.getenv("RENDER_PDF_POOL", "process"),
+        "workers": _env_int("RENDER_PDF_WORKERS", max(1, RENDER_SHARE // 2)),
+    },
+    "video": {
+        "kind": os.getenv("RENDER_VIDEO_POOL", "thread"),
+        "workers": _env_int("RENDER_VIDEO_WORKERS", max(1, RENDER_SHARE // 2)),
+    },
+}
+
+# Per-render safety limits (0 = off): decoded pixel count of an original, and an
+# address-space cap (MiB) applied to process-pool render workers
+RENDER_MAX_PIXELS = _env_int("RENDER_MAX_PIXELS", 0)
+RENDER_MEMORY_LIMIT_MB = _env_int("RENDER_MEMORY_LIMIT_MB", 0)
+
+# Open fitz.Document handles kept per render worker for back-to-back page requests (0 = off)
+PDF_DOCUMENT_CACHE_SIZE = _env_int("PDF_DOCUMENT_CACHE_SIZE", 4)
+
+# Seconds an ffprobe metadata run may take before it is abandoned
+VIDEO_PROBE_TIMEOUT = _env_int("VIDEO_PROBE_TIMEOUT", 15)
+
+# Most frames one batch or storyboard request may pull from a video in a single ffmpeg run
+VIDEO_BATCH_MAX_FRAMES = _env_int("VIDEO_BATCH_MAX_FRAMES", 32)
+
+# Largest page count a single /process/pdf/preview contact sheet may request
+PDF_PREVIEW_MAX_PAGES = _env_int("PDF_PREVIEW_MAX_PAGES", 50)
+
+# Job queue (/jobs): JOB_WORKERS jobs run at once on the maintenance leader, failed
+# attempts are retried after JOB_RETRY_BACKOFF seconds (doubling), finished jobs kept for JOB_RETENTION
+JOB_WORKERS = _env_int("JOB_WORKERS", 2)
+JOB_NICE = _env_int("JOB_NICE", 10)
+JOB_MAX_ATTEMPTS = _env_int("JOB_MAX_ATTEMPTS", 3)
+JOB_RETRY_BACKOFF = _env_int("JOB_RETRY_BACKOFF", 5)
+JOB_POLL_INTERVAL = _env_int("JOB_POLL_INTERVAL", 1)
+JOB_RETENTION = _env_int("JOB_RETENTION", 7 * 24 * 3600)
+
+# Uploads are streamed to disk in chunks; cap how many run at once
+UPLOAD_CHUNK_SIZE = _env_int("UPLOAD_CHUNK_SIZE", 1024 * 1024)
+UPLOAD_CONCURRENCY = _env_int("UPLOAD_CONCURRENCY", 4)
+UPLOAD_MAX_BYTES = _env_int("UPLOAD_MAX_BYTES", 0)  # 0 = no limit beyond nginx
+
+# Admission control, per uvicorn worker. Rate limits are token buckets, "RATE[/BURST]" in
+# requests per second, per API key and per client IP (empty = off). ROUTE_CONCURRENCY caps
+# in-flight requests by first path segment, e.g. "upload=8,transform=16". Past
+# RENDER_QUEUE_MAX renders waiting on a pool (0 = unbounded), new renders get a 503.
+RATE_LIMIT_PER_KEY_ENV = os.getenv("RATE_LIMIT_PER_KEY", "")
+RATE_LIMIT_PER_IP_ENV = os.getenv("RATE_LIMIT_PER_IP", "")
+ROUTE_CONCURRENCY_ENV = os.getenv("ROUTE_CONCURRENCY", "")
+RENDER_QUEUE_MAX = _env_int("RENDER_QUEUE_MAX", 64)
+
+# Asset index: full reconcile scan at startup and then every N seconds (0 = startup only)
+INDEX_RECONCILE_INTERVAL = _env_int("INDEX_RECONCILE_INTERVAL", 3600)
+# The reconcile also deletes cache files the derivative manifest doesn't know that are
+# at least this old: files from the old flat cache layout and renders that crashed
+# before they were recorded
+CACHE_ORPHAN_MIN_AGE = _env_int("CACHE_ORPHAN_MIN_AGE", 3600)
+
+# Derived-asset cache: byte budget (0 = unlimited), per-section quotas
+# ("news=2G,blog=500M"), and "lru" or size-aware "lfu" eviction
+CACHE_MAX_BYTES_ENV = os.getenv("CACHE_MAX_BYTES", "0")
+CACHE_SECTION_QUOTAS_ENV = os.getenv("CACHE_SECTION_QUOTAS", "")
+CACHE_EVICTION_POLICY = os.getenv("CACHE_EVICTION_POLICY", "lru").lower()
+CACHE_GC_INTERVAL = _env_int("CACHE_GC_INTERVAL", 60)
+
+# In-memory hot tier, per worker, for repeat hits on small derivatives: byte budget
+# (0 = off), largest file it keeps, and seconds before an entry re-checks its original
+HOT_CACHE_MAX_BYTES_ENV = os.getenv("HOT_CACHE_MAX_BYTES", "0")
+HOT_CACHE_MAX_ITEM_BYTES_ENV = os.getenv("HOT_CACHE_MAX_ITEM_BYTES", "64K")
+HOT_CACHE_REVALIDATE = _env_int("HOT_CACHE_REVALIDATE", 5)
+
+# Named image variants, e.g. "card=300x300 webp q80; hero=1600w webp; avatar=96x96 thumb".
+# Strict mode rejects /process and /thumbnail sizes that aren't configured.
+MEDIA_VARIANTS_ENV = os.getenv("MEDIA_VARIANTS", "")
+MEDIA_STRICT_VARIANTS = os.getenv("MEDIA_STRICT_VARIANTS", "0") == "1"
+MEDIA_PREGENERATE = os.getenv("MEDIA_PREGENERATE", "0") == "1"
+
+# Responsive images (/srcset): widths, and formats most preferred first, rendered from
+# one decode; also rendered on upload with ?srcset=1 or SRCSET_ON_UPLOAD=1
+SRCSET_WIDTHS_ENV = os.getenv("SRCSET_WIDTHS", "320,640,960,1280,1920")
+SRCSET_FORMATS_ENV = os.getenv("SRCSET_FORMATS", "webp")
+SRCSET_ON_UPLOAD = os.getenv("SRCSET_ON_UPLOAD", "0") == "1"
+SRCSET_MAX_WIDTHS = _env_int("SRCSET_MAX_WIDTHS", 12)
+SRCSET_ENCODE_THREADS = _env_int("SRCSET_ENCODE_THREADS", 4)
+
+# Let nginx send cached files (X-Accel-Redirect to its internal /_accel/ location)
+ACCEL_REDIRECT = os.getenv("ACCEL_REDIRECT", "0") == "1"
+
+# Content-addressed mode: each distinct upload is stored once under objects/ (originals
+# are hardlinks to it) and derivatives are keyed by content hash, so re-uploads reuse them
+CONTENT_ADDRESSED = os.getenv("CONTENT_ADDRESSED", "0") == "1"
+
+# Derivative file layout: "path" mirrors the request URL (nginx try_files finds hits
+# without the app); "hashed" files them under a hash of the full spec, sharded two levels deep
+CACHE_LAYOUT = os.getenv("CACHE_LAYOUT", "path").lower()
+
+# Cross-worker render locks are striped over a fixed set of lock files
+RENDER_LOCK_STRIPES = _env_int("RENDER_LOCK_STRIPES", 1024)
 
 # Supported formats
 SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tiff', '.tif', '.svg'}
@@ -44,6 +186,258 @@ SUPPORTED_DOCUMENT_FORMATS = {'.pdf', '.doc', '.docx', '.txt', '.rtf'}
 
 ALL_SUPPORTED_FORMATS = SUPPORTED_IMAGE_FORMATS.union(SUPPORTED_VIDEO_FORMATS).union(SUPPORTED_DOCUMENT_FORMATS)
 
+# Image output formats: format -> (media type, file extension).
+# AVIF and JPEG XL are only offered when this libvips build can write them.
+IMAGE_OUTPUT_FORMATS = {
+    "webp": ("image/webp", ".webp"),
+    "jpeg": ("image/jpeg", ".jpg"),
+    "png": ("image/png", ".png"),
+    "avif": ("image/avif", ".avif"),
+    "jxl": ("image/jxl", ".jxl"),
+}
+_VIPS_SUFFIXES = set(pyvips.get_suffixes())
+IMAGE_OUTPUT_FORMATS = {
+    name: spec for name, spec in IMAGE_OUTPUT_FORMATS.items() if spec[1] in _VIPS_SUFFIXES
+}
+IMAGE_OUTPUT_FORMAT_REGEX = f"^({'|'.join(IMAGE_OUTPUT_FORMATS)}|auto)$"
+
+# format=auto picks the first of these the client Accepts (JPEG is the fallback)
+AUTO_FORMAT_PREFERENCE = [
+    name.strip() for name in os.getenv("AUTO_FORMATS", "avif,webp,jpeg").split(",")
+    if name.strip() in IMAGE_OUTPUT_FORMATS
+]
+
+# How /process fits an image into WxH: crop to fill it, fit inside it, or stretch to it
+IMAGE_FIT_MODES = ("cover", "contain", "fill")
+IMAGE_FIT_REGEX = f"^({'|'.join(IMAGE_FIT_MODES)})$"
+
+# Encoder effort: higher is smaller output for more CPU
+WEBP_EFFORT = _env_int("WEBP_EFFORT", 4)        # 0-6
+AVIF_EFFORT = _env_int("AVIF_EFFORT", 4)        # 0-9
+JXL_EFFORT = _env_int("JXL_EFFORT", 7)          # 1-9
+PNG_COMPRESSION = _env_int("PNG_COMPRESSION", 9)  # 0-9
+
+# Derivatives advertised for every upload
+DEFAULT_PROCESSED_SIZE = (300, 300)
+DEFAULT_THUMBNAIL_SIZE = (150, 150)
+
+# ---------------------------
+# Metrics & Request Context
+# ---------------------------
+# With several uvicorn workers, PROMETHEUS_MULTIPROC_DIR makes /metrics aggregate all of them
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+REQUEST_LATENCY = Histogram(
+    "tixa_request_duration_seconds", "Request latency by route",
+    ["route", "method", "status"],
+)
+CACHE_LOOKUPS = Counter(
+    "tixa_cache_lookups_total", "Derived-asset cache lookups by derivative type",
+    ["kind", "result"],
+)
+RENDER_STAGE_SECONDS = Histogram(
+    "tixa_render_stage_seconds", "Render time by derivative type and stage (decode, resize, encode, ffmpeg, pymupdf, ffprobe)",
+    ["kind", "stage"],
+)
+RENDER_QUEUE_WAIT = Histogram(
+    "tixa_render_queue_wait_seconds", "Time render jobs wait for an executor slot",
+    ["pool"],
+)
+RENDER_QUEUE_DEPTH = Gauge(
+    "tixa_render_queue_depth", "Render jobs waiting for an executor slot",
+    ["pool"], multiprocess_mode="livesum",
+)
+RENDER_ACTIVE = Gauge(
+    "tixa_render_active", "Render jobs currently running",
+    ["pool"], multiprocess_mode="livesum",
+)
+UPLOAD_BYTES = Counter("tixa_upload_bytes_total", "Bytes received by uploads", ["type"])
+JOB_OUTCOMES = Counter("tixa_jobs_total", "Finished job attempts", ["type", "outcome"])
+
+# Add a Server-Timing header (render stages and total app time) to every response
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Request headers for helpers that build responses outside the route signature,
+# and the Server-Timing entries collected while handling the request
+_request_headers: contextvars.ContextVar = contextvars.ContextVar("request_headers", default=None)
+_server_timings: contextvars.ContextVar = contextvars.ContextVar("server_timings", default=None)
+
+def record_timings(kind: str, timings: dict) -> None:
+    entries = _server_timings.get()
+    for stage, seconds in timings.items():
+        RENDER_STAGE_SECONDS.labels(kind, stage).observe(seconds)
+        if entries is not None:
+            entries.append((stage, seconds))
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        _request_headers.set(Headers(scope=scope))
+        timings = []
+        _server_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings]
+                    entries.append(f"app;dur={(time.perf_counter() - started) * 1000:.1f}")
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", ", ".join(entries).encode())
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # Label by route template, not the concrete path, to keep cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(route, scope["method"], str(status)).observe(time.perf_counter() - started)
+
+@app.get("/metrics")
+async def metrics():
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.on_event("shutdown")
+async def _mark_metrics_dead():
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+# ---------------------------
+# Admission Control
+# ---------------------------
+# Runs inside CORS, so rejections still carry CORS headers. Cache hits never wait
+# for a render slot, and /health and /metrics are never limited.
+ADMISSION_EXEMPT_PATHS = ("/health", "/metrics")
+RATE_LIMIT_MAX_CLIENTS = 10_000
+
+ADMISSION_REJECTIONS = Counter(
+    "tixa_admission_rejections_total", "Requests turned away by admission control",
+    ["reason"],
+)
+
+def _parse_rate(spec: str) -> Optional[tuple]:
+    if not spec.strip():
+        return None
+    rate, _, burst = spec.partition("/")
+    rate = float(rate)
+    burst = float(burst) if burst else max(1.0, rate)
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"Invalid rate limit '{spec}'")
+    return rate, burst
+
+def _parse_route_limits(spec: str) -> dict:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            group, limit = item.split("=", 1)
+            limits[group.strip().strip("/")] = int(limit)
+    return limits
+
+class TokenBuckets:
+    """One token bucket per client; the least recently seen are forgotten past max_clients."""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def take(self, client: str) -> float:
+        """Spend a token, returning 0, or the seconds until the client has one again."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return wait
+
+RATE_LIMITS = {
+    name: TokenBuckets(*rate)
+    for name, rate in (("key", _parse_rate(RATE_LIMIT_PER_KEY_ENV)), ("ip", _parse_rate(RATE_LIMIT_PER_IP_ENV)))
+    if rate
+}
+ROUTE_LIMITS = _parse_route_limits(ROUTE_CONCURRENCY_ENV)
+_route_inflight: dict = {}
+
+class ServiceOverloaded(HTTPException):
+    """503 with a Retry-After hint; routes re-raise it rather than reporting a 500."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(
+            status_code=503, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+def _client_ip(scope) -> str:
+    client = (scope.get("client") or ("", 0))[0]
+    # Behind the local nginx the peer is loopback; the real address is in X-Real-IP
+    if client in ("127.0.0.1", "::1"):
+        return Headers(scope=scope).get("x-real-ip") or client
+    return client
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def _reject(self, scope, receive, send, reason: str, status: int, detail: str, retry_after: float):
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        response = JSONResponse(
+            {"detail": detail}, status_code=status, headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in ADMISSION_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        # Made-up keys would each get a fresh bucket, so only the real key has one;
+        # everything else is limited per IP
+        api_key = Headers(scope=scope).get("x-api-key")
+        clients = {"key": api_key if api_key == API_KEY else None, "ip": _client_ip(scope)}
+        for name, buckets in RATE_LIMITS.items():
+            if clients[name]:
+                wait = buckets.take(clients[name])
+                if wait:
+                    await self._reject(scope, receive, send, f"rate_{name}", 429, "Too many requests", wait)
+                    return
+
+        group = scope["path"].split("/", 2)[1]
+        limit = ROUTE_LIMITS.get(group)
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+        if _route_inflight.get(group, 0) >= limit:
+            await self._reject(scope, receive, send, "route", 503, f"Too many concurrent /{group} requests", 1)
+            return
+        _route_inflight[group] = _route_inflight.get(group, 0) + 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _route_inflight[group] -= 1
+
+app.add_middleware(AdmissionMiddleware)
+
 # ---------------------------
 # CORS
 # ---------------------------
@@ -55,6 +449,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it is outermost: admission 429/503s are timed and counted too
+app.add_middleware(RequestContextMiddleware)
+
 # ---------------------------
 # Security & Utilities
 # ---------------------------
@@ -108,14 +505,1250 @@ def _prune_empty_parents(start_dir: Path, stop_dir: Path) -> None:
     except Exception:
         pass
 
+# ---------------------------
+# Render Executors
+# ---------------------------
+def _init_render_worker(limit_mb: int, nice: int) -> None:
+    if limit_mb > 0:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if nice > 0:
+        # Inherited by the ffmpeg children it starts
+        os.nice(nice)
+
+class RenderPool:
+    """Bounded executor for one job type.
+
+    Jobs wait on an in-loop semaphore rather than inside the executor, so the
+    number of waiting jobs and their wait time can be reported, and new jobs
+    turned away while RENDER_QUEUE_MAX are already waiting.
+    """
+
+    def __init__(self, name: str, kind: str, workers: int, nice: int = 0):
+        self.name = name
+        self.kind = "process" if kind == "process" else "thread"
+        self.workers = max(1, workers)
+        self.nice = nice
+        self._executor = None
+        self._slots = asyncio.Semaphore(self.workers)
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_render_worker,
+                    initargs=(RENDER_MEMORY_LIMIT_MB, self.nice),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix=f"render-{self.name}",
+                )
+        return self._executor
+
+    async def run(self, func, *args, shed: bool = True):
+        if shed and RENDER_QUEUE_MAX and self.waiting >= RENDER_QUEUE_MAX:
+            ADMISSION_REJECTIONS.labels("render_queue").inc()
+            finished = self.completed + self.failed
+            # Recent waits are the best guess at how long until a slot frees up
+            raise ServiceOverloaded(
+                f"Render queue for {self.name} is full, retry later",
+                self.total_wait / finished if finished else 1,
+            )
+        loop = asyncio.get_running_loop()
+        enqueued = time.monotonic()
+        self.waiting += 1
+        RENDER_QUEUE_DEPTH.labels(self.name).inc()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+            RENDER_QUEUE_DEPTH.labels(self.name).dec()
+
+        wait = time.monotonic() - enqueued
+        self.last_wait = wait
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        RENDER_QUEUE_WAIT.labels(self.name).observe(wait)
+        entries = _server_timings.get()
+        if entries is not None:
+            entries.append(("queue", wait))
+
+        self.active += 1
+        RENDER_ACTIVE.labels(self.name).inc()
+        try:
+            result = await loop.run_in_executor(self._get_executor(), functools.partial(func, *args))
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            RENDER_ACTIVE.labels(self.name).dec()
+            self._slots.release()
+
+    def stats(self) -> dict:
+        finished = self.completed + self.failed
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_wait_ms": round(self.total_wait / finished * 1000, 2) if finished else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "last_wait_ms": round(self.last_wait * 1000, 2),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+RENDER_POOLS = {
+    name: RenderPool(name, cfg["kind"], cfg["workers"])
+    for name, cfg in RENDER_POOL_CONFIG.items()
+}
+# Every render started from a queued job goes to its own niced process pool,
+# so batch work never takes slots from interactive requests
+RENDER_POOLS["batch"] = RenderPool("batch", "process", JOB_WORKERS, nice=JOB_NICE)
+_batch_render: contextvars.ContextVar = contextvars.ContextVar("batch_render", default=False)
+
+async def run_render(pool: str, func, *args, shed: bool = True):
+    # Queued jobs wait their turn instead of being shed
+    if _batch_render.get():
+        return await RENDER_POOLS["batch"].run(func, *args, shed=False)
+    return await RENDER_POOLS[pool].run(func, *args, shed=shed)
+
+def render_pool_stats() -> dict:
+    return {name: pool.stats() for name, pool in RENDER_POOLS.items()}
+
+@app.on_event("shutdown")
+async def _shutdown_render_pools():
+    for pool in RENDER_POOLS.values():
+        pool.shutdown()
+
+# ---------------------------
+# Single-flight Cache Writes
+# ---------------------------
+_inflight_renders: dict = {}
+
+def _temp_path_for(dest: Path) -> Path:
+    # Keep the suffix: pyvips and ffmpeg pick the encoder from it
+    return dest.with_name(f".tmp-{uuid.uuid4().hex}-{dest.name}")
+
+def _lock_path_for(key: str) -> Path:
+    stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % max(1, RENDER_LOCK_STRIPES)
+    return LOCKS_DIR / f"render-{stripe:04x}.lock"
+
+async def _acquire_file_lock(lock_path: Path) -> int:
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+    delay = 0.005
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        except Exception:
+            os.close(fd)
+            raise
+
+def _release_file_lock(fd: int) -> None:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+async def _acquire_render_lock(key: str) -> Optional[int]:
+    # Batch renders wait in the niced pool; holding a lock stripe all that time would stall
+    # interactive renders on the same stripe, so they go without and may rarely duplicate one
+    if _batch_render.get():
+        return None
+    return await _acquire_file_lock(_lock_path_for(key))
+
+async def _render_locked(cache_path: Path, kind: str, pool: str, func, src: str, *args) -> None:
+    fd = await _acquire_render_lock(str(cache_path))
+    try:
+        # Another uvicorn worker may have finished it while we waited
+        if cache_path.exists():
+            return
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = _temp_path_for(cache_path)
+        try:
+            timings = await run_render(pool, func, src, str(tmp_path), *args)
+            os.replace(tmp_path, cache_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        spec = {"render": func.__name__, "args": list(args)}
+        await asyncio.to_thread(_record_derivative, cache_path, _original_rel_path(Path(src)), kind, spec)
+        if timings:
+            record_timings(kind, timings)
+    finally:
+        if fd is not None:
+            _release_file_lock(fd)
+
+async def render_once(cache_path: Path, kind: str, pool: str, func, src: str, *args) -> None:
+    """Render ``func(src, dest, *args)`` into cache_path exactly once.
+
+    Render functions may return a {stage: seconds} dict, which is recorded as
+    render stage timings for this kind of derivative.
+
+    Concurrent misses on the same path share one render; the output is written
+    to a temp file and renamed into place so readers never see partial files,
+    then recorded in the derivative manifest under its original. A render that
+    finds the pool's wait queue full raises ServiceOverloaded (503).
+    """
+    CACHE_STATS["misses"] += 1
+    CACHE_LOOKUPS.labels(kind, "miss").inc()
+    await _join_inflight(str(cache_path), lambda: _render_locked(cache_path, kind, pool, func, src, *args))
+
+async def _join_inflight(key: str, start):
+    """Await the in-flight render for key, starting it with ``start()`` if there is none."""
+    if _batch_render.get():
+        # Interactive requests must never end up waiting on the niced batch pool
+        key = f"batch:{key}"
+    task = _inflight_renders.get(key)
+    if task is None:
+        task = asyncio.ensure_future(start())
+        _inflight_renders[key] = task
+
+        def _done(t):
+            if _inflight_renders.get(key) is t:
+                del _inflight_renders[key]
+            if not t.cancelled():
+                t.exception()
+
+        task.add_done_callback(_done)
+    # Shielded so a client disconnect doesn't cancel a render others wait on
+    return await asyncio.shield(task)
+
+# ---------------------------
+# Asset Index (SQLite)
+# ---------------------------
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    path TEXT PRIMARY KEY,
+    section TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    ctime REAL NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    bands INTEGER,
+    page_count INTEGER,
+    is_encrypted INTEGER,
+    sha256 TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assets_section_mtime ON assets (section, mtime DESC, path DESC);
+CREATE INDEX IF NOT EXISTS assets_sha256 ON assets (sha256);
+
+CREATE TABLE IF NOT EXISTS derivatives (
+    cache_path TEXT PRIMARY KEY,
+    original TEXT NOT NULL,
+    section TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    spec TEXT
+);
+CREATE INDEX IF NOT EXISTS derivatives_original ON derivatives (original);
+CREATE INDEX IF NOT EXISTS derivatives_section ON derivatives (section, last_access);
+CREATE INDEX IF NOT EXISTS derivatives_last_access ON derivatives (last_access);
+
+CREATE TABLE IF NOT EXISTS media_probes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    data TEXT NOT NULL,
+    probed_at REAL NOT NULL
+);
+"""
+
+# Identical specs share a job only while it is queued or running
+_JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    spec_key TEXT NOT NULL,
+    type TEXT NOT NULL,
+    params TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_spec ON jobs (spec_key) WHERE status IN ('queued', 'running');
+"""
+
+_db_local = threading.local()
+_background_tasks: set = set()
+
+def _migrate_index(conn: sqlite3.Connection) -> None:
+    # Columns added after a table was first created
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(derivatives)")}
+    if "spec" not in columns:
+        try:
+            conn.execute("ALTER TABLE derivatives ADD COLUMN spec TEXT")
+        except sqlite3.OperationalError:
+            pass  # another worker got there first
+    # jobs.spec_key used to be UNIQUE across all statuses, so finished jobs never reran
+    if any(index["origin"] == "u" for index in conn.execute("PRAGMA index_list(jobs)")):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if any(index["origin"] == "u" for index in conn.execute("PRAGMA index_list(jobs)")):
+                for index in ("jobs_queue", "jobs_finished", "jobs_active_spec"):
+                    conn.execute(f"DROP INDEX IF EXISTS {index}")
+                conn.execute("ALTER TABLE jobs RENAME TO jobs_unique_spec")
+                for statement in filter(str.strip, _JOBS_SCHEMA.split(";")):
+                    conn.execute(statement)
+                conn.execute("INSERT INTO jobs SELECT * FROM jobs_unique_spec")
+                conn.execute("DROP TABLE jobs_unique_spec")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def _db() -> sqlite3.Connection:
+    # One connection per thread; WAL lets every uvicorn worker read while one writes
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(INDEX_DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_INDEX_SCHEMA + _JOBS_SCHEMA)
+        _migrate_index(conn)
+        _db_local.conn = conn
+    return conn
+
+def _original_rel_path(full_path: Path) -> str:
+    return full_path.relative_to(ORIGINALS_DIR).as_posix()
+
+def _section_of(rel_path: str) -> str:
+    return rel_path.split("/", 1)[0] if "/" in rel_path else ""
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _probe_original(path: str, file_type: str) -> dict:
+    meta = {}
+    if file_type == "image":
+        image = pyvips.Image.new_from_file(path)
+        meta.update(width=image.width, height=image.height, format=image.format, bands=image.bands)
+    elif file_type == "pdf":
+        pdf_document = fitz.open(path)
+        try:
+            meta.update(page_count=len(pdf_document), is_encrypted=int(pdf_document.is_encrypted))
+        finally:
+            pdf_document.close()
+    return meta
+
+def _index_upsert(rel_path: str, file_type: str, stats: os.stat_result, meta: dict, sha256: Optional[str]) -> None:
+    _db().execute(
+        """
+        INSERT OR REPLACE INTO assets (
+            path, section, name, type, size, mtime, ctime,
+            width, height, format, bands, page_count, is_encrypted, sha256, indexed_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            rel_path, _section_of(rel_path), rel_path.rsplit("/", 1)[-1], file_type,
+            stats.st_size, stats.st_mtime, stats.st_ctime,
+            meta.get("width"), meta.get("height"), meta.get("format"), meta.get("bands"),
+            meta.get("page_count"), meta.get("is_encrypted"), sha256, time.time(),
+        ),
+    )
+
+def _indexed_sha256(rel_path: str) -> Optional[str]:
+    row = _db().execute("SELECT sha256 FROM assets WHERE path = ?", (rel_path,)).fetchone()
+    return row["sha256"] if row else None
+
+def _indexed_meta(rel_path: str, stats: os.stat_result) -> Optional[dict]:
+    """The indexed _probe_original fields for rel_path, or None if it isn't indexed at this size and mtime."""
+    row = _db().execute(
+        "SELECT size, mtime, width, height, format, bands, page_count, is_encrypted FROM assets WHERE path = ?",
+        (rel_path,),
+    ).fetchone()
+    if row is None or (row["size"], row["mtime"]) != (stats.st_size, stats.st_mtime):
+        return None
+    return {key: row[key] for key in ("width", "height", "format", "bands", "page_count", "is_encrypted")}
+
+def _index_remove(rel_path: str) -> None:
+    conn = _db()
+    conn.execute("DELETE FROM assets WHERE path = ?", (rel_path,))
+    conn.execute("DELETE FROM media_probes WHERE path = ?", (rel_path,))
+
+async def index_original(full_path: Path, sha256: Optional[str] = None) -> None:
+    """Add or refresh one original in the index."""
+    rel_path = _original_rel_path(full_path)
+    # New or changed content: nothing rendered from the old bytes may be served from memory
+    HOT_CACHE.invalidate(rel_path)
+    file_type = get_file_type(full_path.name)
+    stats = full_path.stat()
+    meta = {}
+    if file_type in ("image", "pdf"):
+        try:
+            meta = await run_render(file_type, _probe_original, str(full_path), file_type, shed=False)
+        except Exception:
+            meta = {}
+    elif file_type == "video":
+        try:
+            await video_metadata(full_path)
+        except Exception:
+            pass
+    if sha256 is None:
+        sha256 = await asyncio.to_thread(_hash_file, str(full_path))
+        if CONTENT_ADDRESSED:
+            # Files that arrived without an upload join the object store too
+            await asyncio.to_thread(_store_object, full_path, sha256)
+            stats = full_path.stat()
+    await asyncio.to_thread(_index_upsert, rel_path, file_type, stats, meta, sha256)
+
+def _scan_originals() -> dict:
+    found = {}
+    for root, dirs, files in os.walk(ORIGINALS_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith("."):
+                continue
+            full_path = Path(root) / name
+            try:
+                stats = full_path.stat()
+            except OSError:
+                continue
+            found[_original_rel_path(full_path)] = (stats.st_size, stats.st_mtime)
+    return found
+
+def _indexed_originals() -> dict:
+    rows = _db().execute("SELECT path, size, mtime FROM assets").fetchall()
+    return {row["path"]: (row["size"], row["mtime"]) for row in rows}
+
+def _sweep_unrecorded_cache() -> int:
+    """Delete cache files older than CACHE_ORPHAN_MIN_AGE that aren't in the derivatives manifest."""
+    conn = _db()
+    cutoff = time.time() - CACHE_ORPHAN_MIN_AGE
+    removed = 0
+    for root_dir in (CACHE_DIR, THUMBNAILS_DIR):
+        for root, _, files in os.walk(root_dir):
+            for name in files:
+                cache_path = Path(root) / name
+                rel_cache_path = cache_path.relative_to(BASE_PATH).as_posix()
+                try:
+                    if cache_path.stat().st_mtime > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if conn.execute("SELECT 1 FROM derivatives WHERE cache_path = ?", (rel_cache_path,)).fetchone():
+                    continue
+                if _unlink_cached(rel_cache_path):
+                    removed += 1
+    return removed
+
+async def reconcile_index() -> dict:
+    """Bring the index in line with what is on disk."""
+    on_disk = await asyncio.to_thread(_scan_originals)
+    indexed = await asyncio.to_thread(_indexed_originals)
+
+    added = updated = 0
+    for rel_path, state in on_disk.items():
+        if indexed.get(rel_path) == state:
+            continue
+        try:
+            await index_original(ORIGINALS_DIR / rel_path)
+        except Exception as e:
+            print(f"Error indexing {rel_path}: {e}")
+            continue
+        if rel_path in indexed:
+            updated += 1
+        else:
+            added += 1
+
+    missing = [rel_path for rel_path in indexed if rel_path not in on_disk]
+    for rel_path in missing:
+        await asyncio.to_thread(_index_remove, rel_path)
+
+    result = {"added": added, "updated": updated, "removed": len(missing), "total": len(on_disk)}
+    if CONTENT_ADDRESSED:
+        result["objects_removed"] = await asyncio.to_thread(_collect_objects)
+    result["cache_orphans_removed"] = await asyncio.to_thread(_sweep_unrecorded_cache)
+    return result
+
+async def _index_reconcile_loop():
+    while True:
+        try:
+            if is_maintenance_leader():
+                await reconcile_index()
+        except Exception as e:
+            print(f"Index reconcile failed: {e}")
+        if INDEX_RECONCILE_INTERVAL <= 0:
+            return
+        await asyncio.sleep(INDEX_RECONCILE_INTERVAL)
+
+_leader_fd: Optional[int] = None
+
+def is_maintenance_leader() -> bool:
+    """Whether this uvicorn worker runs the shared maintenance jobs (reconcile, eviction)."""
+    global _leader_fd
+    if _leader_fd is None:
+        fd = os.open(LOCKS_DIR / "leader.lock", os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # Held for the life of the process; the kernel releases it if we die
+        _leader_fd = fd
+    return True
+
+def _start_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def _start_index_reconcile():
+    _start_background(_index_reconcile_loop())
+
+@app.on_event("shutdown")
+async def _stop_background_tasks():
+    for task in list(_background_tasks):
+        task.cancel()
+
+@app.post("/index/reconcile")
+async def reconcile_index_endpoint(api_key: str = Depends(verify_api_key)):
+    return await reconcile_index()
+
+def _path_prefix_range(prefix: str) -> tuple:
+    # Every path under "<prefix>/" sorts in ["<prefix>/", "<prefix>0")
+    return f"{prefix}/", f"{prefix}0"
+
+# ---------------------------
+# Content-Addressed Storage
+# ---------------------------
+# Originals stay where their URLs point, as hardlinks to objects/<aa>/<sha256>:
+# nginx serves them as before, and an object goes away with its last reference.
+_content_hashes: OrderedDict = OrderedDict()
+_content_hashes_lock = threading.Lock()
+CONTENT_HASH_CACHE_SIZE = 4096
+
+def _object_path(sha256: str) -> Path:
+    return OBJECTS_DIR / sha256[:2] / sha256
+
+def _store_object(full_path: Path, sha256: str) -> bool:
+    """Make full_path a reference to the object for sha256; True if those bytes were already stored."""
+    object_path = _object_path(sha256)
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        try:
+            os.link(full_path, object_path)
+            return False
+        except FileExistsError:
+            pass
+        tmp_path = full_path.with_name(f".link-{uuid.uuid4().hex}")
+        try:
+            if os.path.samestat(full_path.stat(), object_path.stat()):
+                return True
+            os.link(object_path, tmp_path)
+        except FileNotFoundError:
+            # Collected between the two links; store this copy instead
+            continue
+        os.replace(tmp_path, full_path)
+        return True
+
+def _content_hash(full_path: Path) -> str:
+    stats = full_path.stat()
+    key = (stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns)
+    with _content_hashes_lock:
+        if key in _content_hashes:
+            _content_hashes.move_to_end(key)
+            return _content_hashes[key]
+    row = _db().execute(
+        "SELECT sha256, size, mtime FROM assets WHERE path = ?", (_original_rel_path(full_path),)
+    ).fetchone()
+    if row and row["sha256"] and (row["size"], row["mtime"]) == (stats.st_size, stats.st_mtime):
+        sha256 = row["sha256"]
+    else:
+        sha256 = _hash_file(str(full_path))
+    with _content_hashes_lock:
+        _content_hashes[key] = sha256
+        while len(_content_hashes) > CONTENT_HASH_CACHE_SIZE:
+            _content_hashes.popitem(last=False)
+    return sha256
+
+async def _content_key(full_path: Path) -> Optional[str]:
+    """Cache-path stem for an original's derivatives in content-addressed mode (None otherwise)."""
+    if not CONTENT_ADDRESSED:
+        return None
+    sha256 = await asyncio.to_thread(_content_hash, full_path)
+    return f"_sha256/{sha256[:2]}/{sha256}"
+
+def _release_object(rel_path: str, sha256: str) -> int:
+    """Drop one (already unlinked) reference; the derivatives and object go with the last one."""
+    conn = _db()
+    other = conn.execute("SELECT path FROM assets WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+    if other:
+        conn.execute(
+            "UPDATE derivatives SET original = ?, section = ? WHERE original = ?",
+            (other["path"], _section_of(other["path"]), rel_path),
+        )
+        return 0
+    object_path = _object_path(sha256)
+    try:
+        if object_path.stat().st_nlink > 1:
+            # Still referenced by files the index hasn't seen yet
+            return 0
+        object_path.unlink()
+        _prune_empty_parents(object_path.parent, OBJECTS_DIR)
+    except FileNotFoundError:
+        pass
+    return _purge_derivatives("original = ?", [rel_path])
+
+def _collect_objects() -> int:
+    """Remove objects no original links to any more."""
+    removed = 0
+    for root, _, files in os.walk(OBJECTS_DIR):
+        for name in files:
+            object_path = Path(root) / name
+            try:
+                if object_path.stat().st_nlink == 1:
+                    object_path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
+
+# ---------------------------
+# Video Metadata (ffprobe)
+# ---------------------------
+def _resolve_ffprobe_binary() -> str:
+    if FFPROBE_BIN_ENV:
+        found = FFPROBE_BIN_ENV if os.path.isfile(FFPROBE_BIN_ENV) else shutil.which(FFPROBE_BIN_ENV)
+        if found:
+            return found
+    # Usually installed next to ffmpeg
+    try:
+        sibling = Path(_resolve_ffmpeg_binary()).with_name("ffprobe")
+        if sibling.is_file():
+            return str(sibling)
+    except HTTPException:
+        pass
+    found_default = shutil.which("ffprobe")
+    if found_default:
+        return found_default
+    raise FileNotFoundError("ffprobe not found. Install ffmpeg: apt update && apt install -y ffmpeg")
+
+def _parse_frame_rate(rate: Optional[str]) -> Optional[float]:
+    try:
+        num, _, den = (rate or "").partition("/")
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return round(value, 3) if value else None
+
+def _optional_number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+def _probe_video(src: str, ffprobe_bin: str) -> dict:
+    result = subprocess.run(
+        [ffprobe_bin, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", src],
+        capture_output=True, text=True, timeout=VIDEO_PROBE_TIMEOUT,
+    )
+    if result.returncode != 0:
+        raise Exception(f"ffprobe error: {result.stderr.strip()}")
+    probe = json.loads(result.stdout or "{}")
+    fmt = probe.get("format", {})
+    streams = probe.get("streams", [])
+    video = next((st for st in streams if st.get("codec_type") == "video"), None)
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), None)
+
+    info = {
+        "container": fmt.get("format_name"),
+        "duration": _optional_number(fmt.get("duration")),
+        "bitrate": _optional_number(fmt.get("bit_rate"), int),
+        "video": None,
+        "audio": None,
+    }
+    if video:
+        rotation = _optional_number(video.get("tags", {}).get("rotate"), int)
+        for side_data in video.get("side_data_list", []):
+            if "rotation" in side_data:
+                rotation = _optional_number(side_data["rotation"], int)
+        info["video"] = {
+            "codec": video.get("codec_name"),
+            "profile": video.get("profile"),
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "pixel_format": video.get("pix_fmt"),
+            "frame_rate": _parse_frame_rate(video.get("avg_frame_rate")) or _parse_frame_rate(video.get("r_frame_rate")),
+            "bitrate": _optional_number(video.get("bit_rate"), int),
+            "rotation": (rotation or 0) % 360,
+        }
+    if audio:
+        info["audio"] = {
+            "codec": audio.get("codec_name"),
+            "sample_rate": _optional_number(audio.get("sample_rate"), int),
+            "channels": audio.get("channels"),
+            "bitrate": _optional_number(audio.get("bit_rate"), int),
+        }
+    return info
+
+def _cached_probe(rel_path: str, stats: os.stat_result) -> Optional[dict]:
+    row = _db().execute(
+        "SELECT data FROM media_probes WHERE path = ? AND size = ? AND mtime = ?",
+        (rel_path, stats.st_size, stats.st_mtime),
+    ).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def _store_probe(rel_path: str, stats: os.stat_result, info: dict) -> None:
+    _db().execute(
+        "INSERT OR REPLACE INTO media_probes (path, size, mtime, data, probed_at) VALUES (?, ?, ?, ?, ?)",
+        (rel_path, stats.st_size, stats.st_mtime, json.dumps(info), time.time()),
+    )
+
+async def video_metadata(full_path: Path) -> dict:
+    """ffprobe metadata for a video, cached per (path, mtime, size) in the index."""
+    rel_path = _original_rel_path(full_path)
+    stats = full_path.stat()
+    info = await asyncio.to_thread(_cached_probe, rel_path, stats)
+    if info is None:
+        started = time.perf_counter()
+        info = await run_render("video", _probe_video, str(full_path), _resolve_ffprobe_binary(), shed=False)
+        record_timings("video_probe", {"ffprobe": time.perf_counter() - started})
+        await asyncio.to_thread(_store_probe, rel_path, stats, info)
+    return info
+
+# ---------------------------
+# Derivation Keys
+# ---------------------------
+# Bump to move every derivative to a fresh key (e.g. after an encoder change)
+DERIVATION_VERSION = 1
+
+def derivation_key(kind: str, source: str, params: dict) -> str:
+    """Stable hash of what a derivative is: its kind, its source identity and the full transform spec.
+
+    The source is the original's path, or its content hash in content-addressed mode.
+    """
+    spec = {"v": DERIVATION_VERSION, "kind": kind, "source": source, "params": params}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def _derivative_path(path_layout: Path, kind: str, source: str, ext: str, **params) -> Path:
+    """Where a derivative lives: path_layout as-is, or <kind>/<aa>/<bb>/<key><ext> in the hashed layout."""
+    if CACHE_LAYOUT != "hashed":
+        return path_layout
+    key = derivation_key(kind, source, params)
+    root = THUMBNAILS_DIR if kind == "thumbnail" else CACHE_DIR / kind
+    return root / key[:2] / key[2:4] / f"{key}{ext}"
+
+# ---------------------------
+# Derivative Manifest
+# ---------------------------
+def _record_derivative(cache_path: Path, original: str, kind: str, spec: Optional[dict] = None) -> None:
+    """Add a rendered file to the manifest; spec (the render that made it) is its sidecar."""
+    now = time.time()
+    _db().execute(
+        """
+        INSERT OR REPLACE INTO derivatives (
+            cache_path, original, section, kind, size, created_at, last_access, hits, spec
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)
+        """,
+        (
+            cache_path.relative_to(BASE_PATH).as_posix(), original, _section_of(original),
+            kind, cache_path.stat().st_size, now, now, json.dumps(spec, default=str) if spec else None,
+        ),
+    )
+
+def _unlink_cached(rel_cache_path: str) -> bool:
+    cache_path = BASE_PATH / rel_cache_path
+    try:
+        cache_path.unlink()
+    except FileNotFoundError:
+        return False
+    stop_dir = THUMBNAILS_DIR if cache_path.is_relative_to(THUMBNAILS_DIR) else CACHE_DIR
+    _prune_empty_parents(cache_path.parent, stop_dir)
+    return True
+
+def _purge_derivatives(where: str, params: list) -> int:
+    conn = _db()
+    rows = conn.execute(f"SELECT cache_path FROM derivatives WHERE {where}", params).fetchall()
+    deleted = sum(1 for row in rows if _unlink_cached(row["cache_path"]))
+    conn.execute(f"DELETE FROM derivatives WHERE {where}", params)
+    return deleted
+
+def _delete_originals(rel_paths: list) -> tuple:
+    """Delete originals plus their recorded derivatives; returns (originals, cache files) deleted."""
+    deleted_originals = deleted_cache = 0
+    for rel_path in rel_paths:
+        original_full_path = ORIGINALS_DIR / rel_path
+        sha256 = None
+        if CONTENT_ADDRESSED:
+            sha256 = _indexed_sha256(rel_path)
+            if sha256 is None and original_full_path.is_file():
+                sha256 = _content_hash(original_full_path)
+        try:
+            original_full_path.unlink()
+            deleted_originals += 1
+            _prune_empty_parents(original_full_path.parent, ORIGINALS_DIR)
+        except FileNotFoundError:
+            pass
+        _index_remove(rel_path)
+        if sha256:
+            deleted_cache += _release_object(rel_path, sha256)
+        else:
+            deleted_cache += _purge_derivatives("original = ?", [rel_path])
+    return deleted_originals, deleted_cache
+
+def _delete_prefix(prefix: str) -> tuple:
+    low, high = _path_prefix_range(prefix)
+    conn = _db()
+    rel_paths = [
+        row["path"] for row in
+        conn.execute("SELECT path FROM assets WHERE path >= ? AND path < ?", (low, high)).fetchall()
+    ]
+    deleted_originals, deleted_cache = _delete_originals(rel_paths)
+    # Derivatives whose original was never indexed
+    deleted_cache += _purge_derivatives("original >= ? AND original < ?", [low, high])
+
+    # Anything left on disk that the index didn't know about
+    section_dir = ORIGINALS_DIR / prefix
+    if section_dir.is_dir():
+        shutil.rmtree(section_dir, ignore_errors=True)
+        _prune_empty_parents(section_dir.parent, ORIGINALS_DIR)
+    return deleted_originals, deleted_cache
+
+# ---------------------------
+# Cache Manager
+# ---------------------------
+def _parse_bytes(value: str) -> int:
+    value = value.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value or 0)
+
+def _parse_section_quotas(spec: str) -> dict:
+    quotas = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            quotas[name.strip()] = _parse_bytes(limit)
+    return quotas
+
+CACHE_MAX_BYTES = _parse_bytes(CACHE_MAX_BYTES_ENV)
+CACHE_SECTION_QUOTAS = _parse_section_quotas(CACHE_SECTION_QUOTAS_ENV)
+
+# Evict down to this fraction of a budget so GC doesn't run on every pass
+CACHE_GC_LOW_WATERMARK = 0.9
+
+CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+_pending_touches: dict = {}
+
+def _derivative_kind(cache_path: Path) -> str:
+    if cache_path.is_relative_to(THUMBNAILS_DIR):
+        return "thumbnail"
+    return cache_path.relative_to(CACHE_DIR).parts[0]
+
+def _touch_derivative(cache_path: Path) -> None:
+    CACHE_STATS["hits"] += 1
+    CACHE_LOOKUPS.labels(_derivative_kind(cache_path), "hit").inc()
+    key = cache_path.relative_to(BASE_PATH).as_posix()
+    hits, _ = _pending_touches.get(key, (0, 0.0))
+    _pending_touches[key] = (hits + 1, time.time())
+
+def _validators(cache_path: Path) -> tuple:
+    # Same ETag and Last-Modified nginx sends for this file from try_files or
+    # /_accel/, so revalidation works whichever of them answered first
+    stats = cache_path.stat()
+    return f'"{int(stats.st_mtime):x}-{stats.st_size:x}"', stats.st_mtime
+
+def _not_modified(headers: Headers, etag: str, last_modified: float) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def file_response(cache_path: Path, media_type: str, source: Optional[Path] = None,
+                  hot_key: Optional[tuple] = None) -> Response:
+    etag, last_modified = _validators(cache_path)
+    headers = {"ETag": etag, "Last-Modified": formatdate(last_modified, usegmt=True)}
+
+    request_headers = _request_headers.get()
+    if request_headers is not None and _not_modified(request_headers, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    # Range requests skip the hot tier and get their 206/416 from the file paths below
+    if hot_key is not None and not (request_headers is not None and "range" in request_headers):
+        body = HOT_CACHE.put(hot_key, cache_path, source, media_type, etag, last_modified)
+        if body is not None:
+            return Response(body, media_type=media_type, headers={"Accept-Ranges": "bytes", **headers})
+
+    if ACCEL_REDIRECT:
+        # nginx streams the file itself with sendfile (and answers Range requests)
+        accel_path = "/_accel/" + quote(cache_path.relative_to(BASE_PATH).as_posix())
+        return Response(media_type=media_type, headers={"X-Accel-Redirect": accel_path, **headers})
+    # FileResponse handles Range / If-Range against the ETag above
+    return FileResponse(cache_path, media_type=media_type, headers=headers)
+
+def cached_file_response(cache_path: Path, media_type: str, source: Optional[Path] = None,
+                         hot_key: Optional[tuple] = None) -> Response:
+    _touch_derivative(cache_path)
+    return file_response(cache_path, media_type, source, hot_key)
+
+def _flush_touches(touches: dict) -> None:
+    _db().executemany(
+        "UPDATE derivatives SET hits = hits + ?, last_access = MAX(last_access, ?) WHERE cache_path = ?",
+        [(hits, last_access, key) for key, (hits, last_access) in touches.items()],
+    )
+
+def _eviction_order() -> str:
+    if CACHE_EVICTION_POLICY == "lfu":
+        # Size-aware LFU: cheapest hits-per-byte go first
+        return "CAST(hits AS REAL) / MAX(size, 1) ASC, last_access ASC"
+    return "last_access ASC"
+
+def _cached_atime(rel_cache_path: str) -> float:
+    try:
+        return (BASE_PATH / rel_cache_path).stat().st_atime
+    except OSError:
+        return 0.0
+
+def _evict(where: str, params: list, bytes_to_free: int) -> None:
+    conn = _db()
+    while bytes_to_free > 0:
+        rows = conn.execute(
+            f"SELECT cache_path, size, last_access FROM derivatives WHERE {where} ORDER BY {_eviction_order()} LIMIT 256",
+            params,
+        ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            # Hits served by nginx never reach us; relatime still bumps atime
+            atime = _cached_atime(row["cache_path"])
+            if atime > row["last_access"] + 1:
+                conn.execute(
+                    "UPDATE derivatives SET last_access = ? WHERE cache_path = ?",
+                    (atime, row["cache_path"]),
+                )
+                continue
+            _unlink_cached(row["cache_path"])
+            conn.execute("DELETE FROM derivatives WHERE cache_path = ?", (row["cache_path"],))
+            CACHE_STATS["evictions"] += 1
+            CACHE_STATS["evicted_bytes"] += row["size"]
+            bytes_to_free -= row["size"]
+            if bytes_to_free <= 0:
+                return
+
+def _cache_usage() -> tuple:
+    conn = _db()
+    total = conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM derivatives").fetchone()
+    sections = conn.execute(
+        "SELECT section, SUM(size) AS bytes, COUNT(*) AS files FROM derivatives GROUP BY section"
+    ).fetchall()
+    return (total[0], total[1]), {row["section"]: (row["bytes"], row["files"]) for row in sections}
+
+def run_cache_gc(touches: dict, evict: bool = True) -> None:
+    # Every worker flushes its own access touches; only the leader evicts
+    _flush_touches(touches)
+    if not evict:
+        return
+    (total_bytes, _), by_section = _cache_usage()
+
+    for section, quota in CACHE_SECTION_QUOTAS.items():
+        used = by_section.get(section, (0, 0))[0]
+        if quota and used > quota:
+            _evict("section = ?", [section], used - int(quota * CACHE_GC_LOW_WATERMARK))
+
+    if CACHE_MAX_BYTES:
+        (total_bytes, _), _ = _cache_usage()
+        if total_bytes > CACHE_MAX_BYTES:
+            _evict("1 = 1", [], total_bytes - int(CACHE_MAX_BYTES * CACHE_GC_LOW_WATERMARK))
+
+async def _cache_gc_loop():
+    global _pending_touches
+    while True:
+        await asyncio.sleep(CACHE_GC_INTERVAL)
+        touches, _pending_touches = _pending_touches, {}
+        try:
+            await asyncio.to_thread(run_cache_gc, touches, is_maintenance_leader())
+        except Exception as e:
+            print(f"Cache GC failed: {e}")
+
+@app.on_event("startup")
+async def _start_cache_gc():
+    if CACHE_GC_INTERVAL > 0:
+        _start_background(_cache_gc_loop())
+
+@app.get("/cache/stats")
+async def cache_stats(api_key: str = Depends(verify_api_key)):
+    (total_bytes, total_files), by_section = await asyncio.to_thread(_cache_usage)
+    lookups = CACHE_STATS["hits"] + CACHE_STATS["misses"]
+    return {
+        "policy": CACHE_EVICTION_POLICY,
+        "max_bytes": CACHE_MAX_BYTES,
+        "bytes_used": total_bytes,
+        "files": total_files,
+        "hits": CACHE_STATS["hits"],
+        "misses": CACHE_STATS["misses"],
+        "hit_ratio": round(CACHE_STATS["hits"] / lookups, 4) if lookups else 0.0,
+        "evictions": CACHE_STATS["evictions"],
+        "evicted_bytes": CACHE_STATS["evicted_bytes"],
+        "hot": HOT_CACHE.stats(),
+        "sections": {
+            section: {"bytes_used": used, "files": files, "quota": CACHE_SECTION_QUOTAS.get(section)}
+            for section, (used, files) in by_section.items()
+        },
+    }
+
+def _versioned(url: str, version: Optional[str]) -> str:
+    # Content-hash segment so a re-upload gets new URLs despite "expires 1y".
+    # It only busts browser and CDN caches: nginx try_files ignores it and serves
+    # whatever is on disk, which stays correct because changed originals have
+    # their derivatives purged
+    if not version:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}v={version}"
+
+def _asset_urls(file_url_path: str, file_type: str, sha256: Optional[str] = None) -> dict:
+    original_url = f"{VPS_BASE_URL}/originals/{quote(file_url_path)}"
+    version = sha256[:12] if sha256 else None
+
+    if file_type == "image":
+        processed_url = f"{VPS_BASE_URL}/process/300/300/{quote(file_url_path)}"
+        thumbnail_url = f"{VPS_BASE_URL}/thumbnail/150/150/{quote(file_url_path)}"
+    elif file_type == "video":
+        processed_url = f"{VPS_BASE_URL}/process/video/thumbnail/300x300/{quote(file_url_path)}"
+        thumbnail_url = f"{VPS_BASE_URL}/process/video/thumbnail/150x150/{quote(file_url_path)}"
+    elif file_type == "pdf":
+        processed_url = f"{VPS_BASE_URL}/process/pdf/thumbnail/300x300/{quote(file_url_path)}"
+        thumbnail_url = f"{VPS_BASE_URL}/process/pdf/thumbnail/150x150/{quote(file_url_path)}"
+    else:
+        processed_url = original_url
+        thumbnail_url = original_url
+
+    urls = {
+        "original": _versioned(original_url, version),
+        "processed": _versioned(processed_url, version),
+        "thumbnail": _versioned(thumbnail_url, version),
+        "delete": f"{VPS_BASE_URL}/delete/{quote(file_url_path)}"
+    }
+    if file_type == "image" and MEDIA_VARIANTS:
+        urls["variants"] = {
+            name: _versioned(_variant_url(file_url_path, v), version) for name, v in MEDIA_VARIANTS.items()
+        }
+    return urls
+
+# ---------------------------
+# Hot Cache (in-memory)
+# ---------------------------
+# Keyed by the request rather than the cache path, so a hit skips path resolution,
+# stat() and open() altogether. Entries go in on a disk cache hit, i.e. from the
+# second request on. Deletes and re-indexes drop them in this worker; in the
+# others an entry re-stats its original every HOT_CACHE_REVALIDATE seconds.
+HOT_CACHE_MAX_BYTES = _parse_bytes(HOT_CACHE_MAX_BYTES_ENV)
+HOT_CACHE_MAX_ITEM_BYTES = _parse_bytes(HOT_CACHE_MAX_ITEM_BYTES_ENV)
+
+class HotCache:
+    """Byte-budgeted LRU of encoded derivatives and their validators."""
+
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self._entries = OrderedDict()
+        self._by_original: dict = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry["checked"] > HOT_CACHE_REVALIDATE:
+            try:
+                stats = entry["source"].stat()
+                current = (stats.st_size, stats.st_mtime_ns) == entry["identity"]
+            except OSError:
+                current = False
+            if current:
+                entry["checked"] = time.monotonic()
+            else:
+                self._drop(key)
+                self.invalidations += 1
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: tuple, cache_path: Path, source: Optional[Path], media_type: str, etag: str,
+            last_modified: float) -> Optional[bytes]:
+        """Keep cache_path's bytes under key if it is small enough, returning them (or None)."""
+        if not self.max_item_bytes:
+            return None
+        source = source or cache_path
+        try:
+            if cache_path.stat().st_size > self.max_item_bytes:
+                return None
+            body = cache_path.read_bytes()
+            stats = source.stat()
+        except OSError:
+            return None
+        self._drop(key)
+        original = _original_rel_path(source) if source.is_relative_to(ORIGINALS_DIR) else None
+        self._entries[key] = {
+            "body": body,
+            "media_type": media_type,
+            "etag": etag,
+            "last_modified": last_modified,
+            "cache_path": cache_path,
+            "source": source,
+            "original": original,
+            "identity": (stats.st_size, stats.st_mtime_ns),
+            "checked": time.monotonic(),
+        }
+        if original is not None:
+            self._by_original.setdefault(original, set()).add(key)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return body
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= len(entry["body"])
+        keys = self._by_original.get(entry["original"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_original[entry["original"]]
+
+    def invalidate(self, rel_path: str, prefix: bool = False) -> int:
+        """Drop the entries rendered from rel_path, or from anything under it with prefix=True."""
+        if prefix:
+            originals = [o for o in self._by_original if o == rel_path or o.startswith(rel_path.rstrip("/") + "/")]
+        else:
+            originals = [rel_path]
+        dropped = 0
+        for original in originals:
+            for key in list(self._by_original.get(original, ())):
+                self._drop(key)
+                dropped += 1
+        self.invalidations += dropped
+        return dropped
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "max_bytes": self.max_bytes,
+            "max_item_bytes": self.max_item_bytes,
+            "bytes_used": self.bytes,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+HOT_CACHE = HotCache(HOT_CACHE_MAX_BYTES, HOT_CACHE_MAX_ITEM_BYTES)
+
+def hot_response(key: tuple) -> Optional[Response]:
+    """Answer a request straight from the hot cache, or None on a miss."""
+    if not HOT_CACHE.max_bytes:
+        return None
+    request_headers = _request_headers.get()
+    if request_headers is not None and "range" in request_headers:
+        return None
+    entry = HOT_CACHE.get(key)
+    if entry is None:
+        return None
+    _touch_derivative(entry["cache_path"])
+    headers = {
+        "ETag": entry["etag"],
+        "Last-Modified": formatdate(entry["last_modified"], usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if request_headers is not None and _not_modified(request_headers, entry["etag"], entry["last_modified"]):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type=entry["media_type"], headers=headers)
+
 # ---------------------------
 # Upload Endpoint (Enhanced)
 # ---------------------------
+_upload_slots = asyncio.Semaphore(max(1, UPLOAD_CONCURRENCY))
+
+async def _stream_upload(file: UploadFile, dest_path: Path) -> tuple:
+    """Copy an upload to dest_path chunk by chunk, returning (sha256, size)."""
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = dest_path.with_name(f".upload-{uuid.uuid4().hex}.part")
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if UPLOAD_MAX_BYTES and size > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                await out.write(chunk)
+        os.replace(tmp_path, dest_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return digest.hexdigest(), size
+
 @app.post("/upload/{section:path}")
 async def upload_file(
     section: str,
     file: UploadFile = File(...),
     api_key: str = Depends(verify_api_key),
+    pregenerate: bool = Query(MEDIA_PREGENERATE, description="Render default URLs and variants in the background"),
+    srcset: bool = Query(SRCSET_ON_UPLOAD, description="Render the srcset widths in the background"),
 ):
     # Validate file type
     file_ext = Path(file.filename).suffix.lower()
@@ -131,50 +1764,247 @@ async def upload_file(
     filename = f"{uuid.uuid4().hex}_{file.filename}"
     dest_path = section_dir / filename
 
-    contents = await file.read()
-    with open(dest_path, "wb") as f:
-        f.write(contents)
-    await file.close()
+    async with _upload_slots:
+        try:
+            sha256, size = await _stream_upload(file, dest_path)
+        finally:
+            await file.close()
+
+    deduplicated = False
+    if CONTENT_ADDRESSED:
+        try:
+            deduplicated = await asyncio.to_thread(_store_object, dest_path, sha256)
+        except Exception as e:
+            # Served from its own copy until the reconcile stores it
+            print(f"Error storing object for {dest_path}: {e}")
 
     file_type = get_file_type(file.filename)
+    UPLOAD_BYTES.labels(file_type).inc(size)
 
-    # Generate appropriate URLs based on file type
-    original_url = f"{VPS_BASE_URL}/originals/{quote(section)}/{quote(filename)}"
+    try:
+        await index_original(dest_path, sha256)
+    except Exception as e:
+        # The periodic reconcile picks it up later
+        print(f"Error indexing {dest_path}: {e}")
 
-    if file_type == "image":
-        processed_url = f"{VPS_BASE_URL}/process/300/300/{quote(section)}/{quote(filename)}"
-        thumbnail_url = f"{VPS_BASE_URL}/thumbnail/150/150/{quote(section)}/{quote(filename)}"
-    elif file_type == "video":
-        processed_url = f"{VPS_BASE_URL}/process/video/thumbnail/300x300/{quote(section)}/{quote(filename)}"
-        thumbnail_url = f"{VPS_BASE_URL}/process/video/thumbnail/150x150/{quote(section)}/{quote(filename)}"
-    elif file_type == "pdf":
-        processed_url = f"{VPS_BASE_URL}/process/pdf/thumbnail/300x300/{quote(section)}/{quote(filename)}"
-        thumbnail_url = f"{VPS_BASE_URL}/process/pdf/thumbnail/150x150/{quote(section)}/{quote(filename)}"
-    else:
-        processed_url = original_url
-        thumbnail_url = original_url
+    if pregenerate:
+        _start_background(pregenerate_derivatives(_original_rel_path(dest_path), file_type))
+
+    srcset_manifest = None
+    if srcset and file_type == "image":
+        try:
+            srcset_manifest, _ = await _srcset_plan(dest_path, SRCSET_WIDTHS, SRCSET_FORMATS, 80)
+            _start_background(pregenerate_srcset(_original_rel_path(dest_path)))
+        except Exception as e:
+            print(f"Error planning srcset for {dest_path}: {e}")
+
+    # Generate appropriate URLs based on file type
+    urls = _asset_urls(_original_rel_path(dest_path), file_type, sha256)
 
     return {
         "message": "Upload successful",
         "file_type": file_type,
         "file_name": filename,
-        "original_url": original_url,
-        "processed_url": processed_url,
-        "thumbnail_url": thumbnail_url,
-        "section": section
+        "original_url": urls["original"],
+        "processed_url": urls["processed"],
+        "thumbnail_url": urls["thumbnail"],
+        "variant_urls": urls.get("variants", {}),
+        "srcset": srcset_manifest,
+        "section": section,
+        "size": size,
+        "sha256": sha256,
+        "deduplicated": deduplicated
     }
 
+# ---------------------------
+# Image Variants
+# ---------------------------
+def _parse_variants(spec: str) -> dict:
+    """Parse "name=SIZE [format] [qNN] [fit] [thumb]; ..." where SIZE is WxH, Ww or Hh."""
+    variants = {}
+    for entry in spec.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, rest = entry.partition("=")
+        tokens = rest.lower().split()
+        if not name.strip() or not tokens:
+            raise ValueError(f"Invalid variant '{entry}'")
+
+        size = tokens[0]
+        if "x" in size:
+            width, height = (int(v) for v in size.split("x", 1))
+        elif size.endswith("w"):
+            width, height = int(size[:-1]), 0
+        elif size.endswith("h"):
+            width, height = 0, int(size[:-1])
+        else:
+            raise ValueError(f"Invalid variant size '{size}'")
+
+        variant = {"width": width, "height": height, "format": "webp", "quality": 80,
+                   "fit": "fill", "thumbnail": False}
+        for token in tokens[1:]:
+            if token in IMAGE_OUTPUT_FORMATS:
+                variant["format"] = token
+            elif token in IMAGE_FIT_MODES:
+                variant["fit"] = token
+            elif token.startswith("q") and token[1:].isdigit():
+                variant["quality"] = max(1, min(100, int(token[1:])))
+            elif token in ("thumb", "thumbnail"):
+                variant["thumbnail"] = True
+            else:
+                raise ValueError(f"Unknown variant option '{token}' in '{entry}'")
+
+        if variant["thumbnail"] and (not width or not height):
+            raise ValueError(f"Thumbnail variant '{name}' needs WxH")
+        variants[name.strip()] = variant
+    return variants
+
+MEDIA_VARIANTS = _parse_variants(MEDIA_VARIANTS_ENV)
+
+ALLOWED_PROCESS_SIZES = {DEFAULT_PROCESSED_SIZE} | {
+    (v["width"], v["height"]) for v in MEDIA_VARIANTS.values() if not v["thumbnail"]
+}
+ALLOWED_THUMBNAIL_SIZES = {DEFAULT_THUMBNAIL_SIZE} | {
+    (v["width"], v["height"]) for v in MEDIA_VARIANTS.values() if v["thumbnail"]
+}
+
+def _check_variant_size(width: int, height: int, allowed: set) -> None:
+    if MEDIA_STRICT_VARIANTS and (width, height) not in allowed:
+        raise HTTPException(status_code=400, detail=f"Size {width}x{height} is not an allowed variant")
+
+def _variant_url(file_url_path: str, variant: dict) -> str:
+    if variant["thumbnail"]:
+        return (
+            f"{VPS_BASE_URL}/thumbnail/{variant['width']}/{variant['height']}/{quote(file_url_path)}"
+            f"?quality={variant['quality']}&format={variant['format']}"
+        )
+    url = (
+        f"{VPS_BASE_URL}/process/{variant['width']}/{variant['height']}/{quote(file_url_path)}"
+        f"?quality={variant['quality']}&format={variant['format']}"
+    )
+    if variant["fit"] != "fill":
+        url += f"&fit={variant['fit']}"
+    return url
+
 # ---------------------------
 # Image Processing (Enhanced)
 # ---------------------------
-@app.get("/process/{width}/{height}/{image_path:path}")
+def _negotiate_format(format: str, accept: Optional[str]) -> str:
+    if format != "auto":
+        return format
+    # Only explicitly listed types count: image/* and */* say nothing about AVIF or JXL
+    accepted = set()
+    for media_range in (accept or "").lower().split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(media_type)
+    for candidate in AUTO_FORMAT_PREFERENCE:
+        if IMAGE_OUTPUT_FORMATS[candidate][0] in accepted:
+            return candidate
+    return "jpeg"
+
+def _encode_options(format: str, quality: int) -> dict:
+    if format == "webp":
+        return {"Q": quality, "effort": WEBP_EFFORT}
+    if format == "jpeg":
+        return {"Q": quality, "optimize_coding": True}
+    if format == "png":
+        return {"compression": PNG_COMPRESSION}
+    if format == "avif":
+        return {"Q": quality, "effort": AVIF_EFFORT}
+    if format == "jxl":
+        return {"Q": quality, "effort": JXL_EFFORT}
+    raise ValueError(f"Unsupported output format '{format}'")
+
+def _negotiated_response(response: Response, format_param: str) -> Response:
+    if format_param == "auto":
+        response.headers["Vary"] = "Accept"
+    return response
+
+# libvips' largest image dimension; an "unbounded" side for thumbnail()
+VIPS_MAX_COORD = 10_000_000
+
+def _check_pixel_limit(src: str) -> None:
+    if RENDER_MAX_PIXELS:
+        # Header only; nothing is decoded yet
+        header = pyvips.Image.new_from_file(src, access="sequential")
+        if header.width * header.height > RENDER_MAX_PIXELS:
+            raise ValueError(
+                f"Image is {header.width}x{header.height}, over the {RENDER_MAX_PIXELS} pixel limit"
+            )
+
+# Cache layouts mirror the request URL so nginx can try_files them (see nginx.conf.tpl)
+def _processed_cache_path(image_path: str, width: int, height: int, quality: int, format: str,
+                          fit: str = "fill") -> Path:
+    output_ext = IMAGE_OUTPUT_FORMATS[format][1]
+    format_dir = format if fit == "fill" else f"{format}-{fit}"
+    return _derivative_path(
+        CACHE_DIR / "process" / f"{width}x{height}" / f"q{quality}" / format_dir / f"{image_path}{output_ext}",
+        "process", image_path, output_ext, width=width, height=height, quality=quality, format=format, fit=fit,
+    )
+
+def _timed_thumbnail(src: str, dest: str, quality: int, format: str, width: int, **options) -> dict:
+    started = time.perf_counter()
+    image = pyvips.Image.thumbnail(src, width, **options)
+    opened = time.perf_counter()
+    # libvips is lazy: run the decode and resize now so encoding is timed on its own
+    image = image.copy_memory()
+    resized = time.perf_counter()
+
+    # Save with specified format and quality
+    image.write_to_file(dest, **_encode_options(format, quality))
+    return {"decode": opened - started, "resize": resized - opened, "encode": time.perf_counter() - resized}
+
+def _fit_options(width: int, height: int, fit: str) -> dict:
+    """thumbnail() options, besides the width, for fitting an image into width x height."""
+    if not width or not height:
+        # A zero dimension follows the aspect ratio of the other one
+        return {"height": height or VIPS_MAX_COORD}
+    if fit == "cover":
+        return {"height": height, "crop": "centre"}
+    if fit == "contain":
+        return {"height": height}
+    return {"height": height, "size": "force"}
+
+def _render_resized_image(src: str, dest: str, width: int, height: int, quality: int, format: str,
+                          fit: str = "fill") -> dict:
+    _check_pixel_limit(src)
+
+    # thumbnail() shrinks on load (JPEG/WebP decode at 1/2, 1/4, 1/8 scale) and
+    # streams the rest of the pipeline sequentially
+    return _timed_thumbnail(src, dest, quality, format, width or VIPS_MAX_COORD, **_fit_options(width, height, fit))
+
+@app.get("/process/{width:int}/{height:int}/{image_path:path}")
 async def process_image(
     width: int,
     height: int,
     image_path: str,
     quality: int = Query(80, ge=1, le=100),
-    format: str = Query("webp", regex="^(webp|jpeg|png)$")
+    format: str = Query("webp", regex=IMAGE_OUTPUT_FORMAT_REGEX),
+    fit: str = Query("fill", regex=IMAGE_FIT_REGEX),
+    accept: Optional[str] = Header(None)
 ):
+    format_param = format
+    format = _negotiate_format(format, accept)
+
+    if width < 0 or height < 0 or not (width or height):
+        raise HTTPException(status_code=422, detail="Width or height must be positive")
+    _check_variant_size(width, height, ALLOWED_PROCESS_SIZES)
+
+    hot_key = ("process", image_path, width, height, quality, format, fit)
+    hot = hot_response(hot_key)
+    if hot is not None:
+        return _negotiated_response(hot, format_param)
+
     original_full_path = (ORIGINALS_DIR / image_path).resolve()
 
     if not _safe_within_base(original_full_path):
@@ -182,49 +2012,68 @@ async def process_image(
     if not original_full_path.exists():
         raise HTTPException(status_code=404, detail="Original image not found")
 
-    # Determine output format and extension
-    output_ext = f".{format}" if format != "jpeg" else ".jpg"
-    cache_full_path = (CACHE_DIR / f"{width}x{height}_{quality}_{image_path}").with_suffix(output_ext)
-    cache_full_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_key = await _content_key(original_full_path) or image_path
+    cache_full_path = _processed_cache_path(cache_key, width, height, quality, format, fit)
+    media_type = IMAGE_OUTPUT_FORMATS[format][0]
 
     if cache_full_path.exists():
-        media_type = f"image/{format}" if format != "jpeg" else "image/jpeg"
-        return FileResponse(cache_full_path, media_type=media_type)
+        return _negotiated_response(
+            cached_file_response(cache_full_path, media_type, original_full_path, hot_key), format_param
+        )
 
     try:
-        image = pyvips.Image.new_from_file(str(original_full_path))
-
-        # Resize with different strategies
-        image = image.resize(
-            width / image.width,
-            vscale=height / image.height,
-            kernel='lanczos3'  # Better quality scaling
+        await render_once(
+            cache_full_path, "process", "image", _render_resized_image,
+            str(original_full_path), width, height, quality, format, fit,
         )
+        return _negotiated_response(file_response(cache_full_path, media_type, original_full_path), format_param)
 
-        # Save with specified format and quality
-        if format == "webp":
-            image.write_to_file(str(cache_full_path), Q=quality)
-        elif format == "jpeg":
-            image.write_to_file(str(cache_full_path), Q=quality, optimize_coding=True)
-        elif format == "png":
-            image.write_to_file(str(cache_full_path), compression=9)
-
-        media_type = f"image/{format}" if format != "jpeg" else "image/jpeg"
-        return FileResponse(cache_full_path, media_type=media_type)
-
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image processing error: {str(e)}")
 
 # ---------------------------
 # Image Thumbnail (Preserve Aspect Ratio)
 # ---------------------------
-@app.get("/thumbnail/{width}/{height}/{image_path:path}")
+def _thumbnail_cache_path(image_path: str, width: int, height: int, quality: int, format: str) -> Path:
+    output_ext = IMAGE_OUTPUT_FORMATS[format][1]
+    return _derivative_path(
+        THUMBNAILS_DIR / f"{width}x{height}" / f"q{quality}" / f"{image_path}{output_ext}",
+        "thumbnail", image_path, output_ext, width=width, height=height, quality=quality, format=format,
+    )
+
+def _render_image_thumbnail(src: str, dest: str, width: int, height: int, quality: int, format: str) -> dict:
+    _check_pixel_limit(src)
+
+    # Preserve aspect ratio for thumbnails, shrinking on load
+    return _timed_thumbnail(
+        src, dest, quality, format,
+        width,
+        height=height,
+        crop="centre"  # Crop to exact dimensions
+    )
+
+@app.get("/thumbnail/{width:int}/{height:int}/{image_path:path}")
 async def generate_thumbnail(
     width: int,
     height: int,
     image_path: str,
-    quality: int = Query(80, ge=1, le=100)
+    quality: int = Query(80, ge=1, le=100),
+    format: str = Query("webp", regex=IMAGE_OUTPUT_FORMAT_REGEX),
+    accept: Optional[str] = Header(None)
 ):
+    format_param = format
+    format = _negotiate_format(format, accept)
+    _check_variant_size(width, height, ALLOWED_THUMBNAIL_SIZES)
+
+    hot_key = ("thumbnail", image_path, width, height, quality, format)
+    hot = hot_response(hot_key)
+    if hot is not None:
+        return _negotiated_response(hot, format_param)
+
     original_full_path = (ORIGINALS_DIR / image_path).resolve()
 
     if not _safe_within_base(original_full_path):
@@ -232,27 +2081,441 @@ async def generate_thumbnail(
     if not original_full_path.exists():
         raise HTTPException(status_code=404, detail="Original image not found")
 
-    cache_full_path = (THUMBNAILS_DIR / f"thumb_{width}x{height}_{image_path}").with_suffix(".webp")
-    cache_full_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_key = await _content_key(original_full_path) or image_path
+    cache_full_path = _thumbnail_cache_path(cache_key, width, height, quality, format)
+    media_type = IMAGE_OUTPUT_FORMATS[format][0]
 
     if cache_full_path.exists():
-        return FileResponse(cache_full_path, media_type="image/webp")
+        return _negotiated_response(
+            cached_file_response(cache_full_path, media_type, original_full_path, hot_key), format_param
+        )
 
     try:
-        image = pyvips.Image.new_from_file(str(original_full_path))
+        await render_once(
+            cache_full_path, "thumbnail", "image", _render_image_thumbnail,
+            str(original_full_path), width, height, quality, format,
+        )
+        return _negotiated_response(file_response(cache_full_path, media_type, original_full_path), format_param)
+
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Thumbnail generation error: {str(e)}")
 
-        # Preserve aspect ratio for thumbnails
-        thumb = image.thumbnail_image(
-            width,
-            height=height,
-            crop=True  # Crop to exact dimensions
+# ---------------------------
+# Image Transform Pipeline
+# ---------------------------
+# /transform/{path}?ops=resize:800:0,crop:0:0:800:450,sharpen,text:(c) Kayease:se,strip
+# Ops run left to right in one libvips pipeline: one decode, one encode. EXIF
+# orientation is always applied first. Arguments are ":"-separated, so text and
+# watermark paths can't contain ":" or ",".
+TRANSFORM_MAX_OPS = _env_int("TRANSFORM_MAX_OPS", 16)
+TRANSFORM_GRAVITIES = ("nw", "n", "ne", "w", "c", "e", "sw", "s", "se")
+
+def _transform_number(value: str, low: float, high: float, cast=int):
+    number = cast(value)
+    if not low <= number <= high:
+        raise ValueError(f"{value} is outside {low}-{high}")
+    return number
+
+def _transform_gravity(args: list, index: int) -> str:
+    gravity = args[index] if len(args) > index and args[index] else "se"
+    if gravity not in TRANSFORM_GRAVITIES:
+        raise ValueError(f"Unknown gravity '{gravity}'. Use one of {', '.join(TRANSFORM_GRAVITIES)}")
+    return gravity
+
+def _parse_transform(spec: str) -> list:
+    """Parse an ops string into normalised (op, *args) tuples; the same tuples mean the same output."""
+    ops = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, *args = item.split(":")
+        name = name.lower()
+        if name == "resize":
+            width, height = (_transform_number(a, 0, VIPS_MAX_COORD) for a in (args + ["0", "0"])[:2])
+            fit = args[2] if len(args) > 2 else "fill"
+            if not (width or height) or fit not in IMAGE_FIT_MODES:
+                raise ValueError("resize:W:H[:cover|contain|fill] needs a width or height")
+            ops.append(("resize", width, height, fit))
+        elif name == "crop":
+            if len(args) != 4:
+                raise ValueError("crop:X:Y:W:H")
+            x, y = (_transform_number(a, 0, VIPS_MAX_COORD) for a in args[:2])
+            width, height = (_transform_number(a, 1, VIPS_MAX_COORD) for a in args[2:])
+            ops.append(("crop", x, y, width, height))
+        elif name == "rotate":
+            ops.append(("rotate", _transform_number(args[0] if args else "", -360, 360, float) % 360))
+        elif name == "flip":
+            direction = args[0] if args else "h"
+            if direction not in ("h", "v"):
+                raise ValueError("flip:h or flip:v")
+            ops.append(("flip", direction))
+        elif name == "blur":
+            ops.append(("blur", _transform_number(args[0] if args else "1", 0.3, 50, float)))
+        elif name == "sharpen":
+            ops.append(("sharpen", _transform_number(args[0] if args else "0.5", 0.1, 10, float)))
+        elif name == "flatten":
+            colour = (args[0] if args else "ffffff").lower()
+            if not re.match(r"^[0-9a-f]{6}$", colour):
+                raise ValueError("flatten:RRGGBB")
+            ops.append(("flatten", colour))
+        elif name == "text":
+            text = args[0] if args else ""
+            if not 0 < len(text) <= 100:
+                raise ValueError("text:TEXT[:GRAVITY[:OPACITY]] needs 1-100 characters")
+            opacity = _transform_number(args[2], 0, 1, float) if len(args) > 2 else 0.7
+            ops.append(("text", text, _transform_gravity(args, 1), opacity))
+        elif name == "watermark":
+            if not args or not args[0]:
+                raise ValueError("watermark:PATH[:GRAVITY[:OPACITY[:SCALE]]]")
+            opacity = _transform_number(args[2], 0, 1, float) if len(args) > 2 else 0.7
+            scale = _transform_number(args[3], 0.01, 1, float) if len(args) > 3 else 0.25
+            ops.append(("watermark", args[0], _transform_gravity(args, 1), opacity, scale))
+        elif name == "strip":
+            ops.append(("strip",))
+        else:
+            raise ValueError(f"Unknown transform '{name}'")
+    if not ops:
+        raise ValueError("No transforms given")
+    if len(ops) > TRANSFORM_MAX_OPS:
+        raise ValueError(f"At most {TRANSFORM_MAX_OPS} transforms")
+    return ops
+
+def _transform_key(ops: list) -> str:
+    return ",".join(":".join(str(part) for part in op) for op in ops)
+
+def _transform_cache_path(image_path: str, ops_key: str, quality: int, format: str) -> Path:
+    output_ext = IMAGE_OUTPUT_FORMATS[format][1]
+    ops_dir = hashlib.sha1(ops_key.encode()).hexdigest()[:16]
+    return _derivative_path(
+        CACHE_DIR / "transform" / ops_dir / f"q{quality}" / format / f"{image_path}{output_ext}",
+        "transform", image_path, output_ext, ops=ops_key, quality=quality, format=format,
+    )
+
+def _overlay_position(image, overlay, gravity: str) -> tuple:
+    margin = max(1, min(image.width, image.height) // 50)
+    x = {"w": margin, "c": (image.width - overlay.width) // 2, "e": image.width - overlay.width - margin}
+    y = {"n": margin, "c": (image.height - overlay.height) // 2, "s": image.height - overlay.height - margin}
+    return x[gravity[-1] if gravity[-1] in "we" else "c"], y[gravity[0] if gravity[0] in "ns" else "c"]
+
+def _composite_overlay(image, overlay, gravity: str):
+    """Blend an RGBA overlay onto image, keeping image's band layout."""
+    if image.bands < 3:
+        image = image.colourspace("srgb")
+    had_alpha = image.hasalpha()
+    x, y = _overlay_position(image, overlay, gravity)
+    image = image.composite2(overlay, "over", x=x, y=y)
+    return image if had_alpha else image.extract_band(0, n=image.bands - 1)
+
+def _text_overlay(image, text: str, opacity: float):
+    # text() parses Pango markup; escaped, the user's text is only ever drawn as-is
+    try:
+        mask = pyvips.Image.text(
+            html.escape(text), font="sans bold", width=max(8, image.width * 3 // 5), height=max(8, image.height // 20)
         )
+    except pyvips.Error as e:
+        raise ValueError(f"Cannot render text: {e}")
+    alpha = (mask * opacity).cast("uchar")
+    return mask.new_from_image([255, 255, 255]).bandjoin(alpha).copy(interpretation="srgb")
+
+def _image_overlay(image, src: str, opacity: float, scale: float):
+    overlay = pyvips.Image.thumbnail(
+        src, max(1, int(image.width * scale)), height=max(1, int(image.height * scale))
+    ).colourspace("srgb")
+    if not overlay.hasalpha():
+        overlay = overlay.bandjoin_const(255)
+    alpha = (overlay.extract_band(3) * opacity).cast("uchar")
+    return overlay.extract_band(0, n=3).bandjoin(alpha)
+
+def _render_transform(src: str, dest: str, ops: list, quality: int, format: str) -> dict:
+    _check_pixel_limit(src)
+    started = time.perf_counter()
+
+    # A leading resize shrinks on load; otherwise decode at full size
+    if ops[0][0] == "resize":
+        _, width, height, fit = ops[0]
+        options = _fit_options(width, height, fit)
+        image = pyvips.Image.thumbnail(src, width or VIPS_MAX_COORD, **options)
+        ops = ops[1:]
+    else:
+        image = pyvips.Image.new_from_file(src).autorot()
+
+    encode_options = _encode_options(format, quality)
+    for op, *args in ops:
+        if op == "resize":
+            width, height, fit = args
+            image = image.thumbnail_image(width or VIPS_MAX_COORD, **_fit_options(width, height, fit))
+        elif op == "crop":
+            x, y, width, height = args
+            if x + width > image.width or y + height > image.height:
+                raise ValueError(f"Crop {width}x{height}+{x}+{y} is outside the {image.width}x{image.height} image")
+            image = image.extract_area(x, y, width, height)
+        elif op == "rotate":
+            angle = args[0]
+            if angle % 90 == 0:
+                image = image.rot(f"d{int(angle)}")
+            else:
+                image = image.rotate(angle)
+        elif op == "flip":
+            image = image.fliphor() if args[0] == "h" else image.flipver()
+        elif op == "blur":
+            image = image.gaussblur(args[0])
+        elif op == "sharpen":
+            image = image.sharpen(sigma=args[0])
+        elif op == "flatten":
+            if image.hasalpha():
+                colour = args[0]
+                image = image.flatten(background=[int(colour[i:i + 2], 16) for i in (0, 2, 4)])
+        elif op == "text":
+            text, gravity, opacity = args
+            image = _composite_overlay(image, _text_overlay(image, text, opacity), gravity)
+        elif op == "watermark":
+            path, gravity, opacity, scale = args
+            overlay = _image_overlay(image, str(ORIGINALS_DIR / path), opacity, scale)
+            image = _composite_overlay(image, overlay, gravity)
+        elif op == "strip":
+            # Drop EXIF/XMP/IPTC but keep the colour profile
+            if pyvips.at_least_libvips(8, 15):
+                encode_options["keep"] = "icc"
+            else:
+                encode_options["strip"] = True
+
+    image = image.copy_memory()
+    transformed = time.perf_counter()
+    image.write_to_file(dest, **encode_options)
+    return {"transform": transformed - started, "encode": time.perf_counter() - transformed}
+
+@app.get("/transform/{image_path:path}")
+async def transform_image(
+    image_path: str,
+    ops: str = Query(..., description="Comma-separated transforms, applied in order"),
+    quality: int = Query(80, ge=1, le=100),
+    format: str = Query("webp", regex=IMAGE_OUTPUT_FORMAT_REGEX),
+    accept: Optional[str] = Header(None)
+):
+    format_param = format
+    format = _negotiate_format(format, accept)
+
+    try:
+        op_list = _parse_transform(ops)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    for op in op_list:
+        if op[0] == "resize":
+            _check_variant_size(op[1], op[2], ALLOWED_PROCESS_SIZES)
+        elif op[0] == "watermark":
+            overlay_path = (ORIGINALS_DIR / op[1]).resolve()
+            if not _safe_within_base(overlay_path):
+                raise HTTPException(status_code=403, detail="Forbidden")
+            if not overlay_path.is_file():
+                raise HTTPException(status_code=404, detail="Watermark image not found")
+
+    original_full_path = (ORIGINALS_DIR / image_path).resolve()
 
-        thumb.write_to_file(str(cache_full_path), Q=quality)
-        return FileResponse(cache_full_path, media_type="image/webp")
+    if not _safe_within_base(original_full_path):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not original_full_path.exists():
+        raise HTTPException(status_code=404, detail="Original image not found")
+
+    cache_key = await _content_key(original_full_path) or image_path
+    cache_full_path = _transform_cache_path(cache_key, _transform_key(op_list), quality, format)
+    media_type = IMAGE_OUTPUT_FORMATS[format][0]
+
+    if cache_full_path.exists():
+        return _negotiated_response(cached_file_response(cache_full_path, media_type, original_full_path), format_param)
+
+    try:
+        await render_once(
+            cache_full_path, "transform", "image", _render_transform,
+            str(original_full_path), op_list, quality, format,
+        )
+        return _negotiated_response(file_response(cache_full_path, media_type, original_full_path), format_param)
 
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Thumbnail generation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Transform error: {str(e)}")
+
+# ---------------------------
+# Responsive Images (srcset)
+# ---------------------------
+# The original is decoded once, at the largest width still missing, and every
+# width x format is resized and encoded from that copy. Each output is the file
+# /process/{w}/0 would cache, so the manifest's URLs are plain cache hits.
+def _parse_srcset_widths(spec: str) -> list:
+    widths = sorted({int(width) for width in spec.replace(" ", "").split(",") if width})
+    if not widths or widths[0] < 1 or widths[-1] > VIPS_MAX_COORD:
+        raise ValueError(f"Invalid srcset widths '{spec}'")
+    if len(widths) > SRCSET_MAX_WIDTHS:
+        raise ValueError(f"At most {SRCSET_MAX_WIDTHS} srcset widths")
+    return widths
+
+def _parse_srcset_formats(spec: str) -> list:
+    formats = list(dict.fromkeys(f.strip().lower() for f in spec.split(",") if f.strip()))
+    unknown = [f for f in formats if f not in IMAGE_OUTPUT_FORMATS]
+    if not formats or unknown:
+        raise ValueError(f"Invalid srcset formats '{spec}'. Supported: {', '.join(IMAGE_OUTPUT_FORMATS)}")
+    return formats
+
+SRCSET_WIDTHS = _parse_srcset_widths(SRCSET_WIDTHS_ENV)
+SRCSET_FORMATS = _parse_srcset_formats(SRCSET_FORMATS_ENV)
+# Manifest URLs are /process/{w}/0 URLs, so strict mode accepts the configured widths
+ALLOWED_PROCESS_SIZES |= {(width, 0) for width in SRCSET_WIDTHS}
+
+def _display_size(src: str) -> tuple:
+    # Header only; orientations 5-8 swap the sides once auto-rotated
+    header = pyvips.Image.new_from_file(src)
+    if header.get_typeof("orientation") and header.get("orientation") >= 5:
+        return header.height, header.width
+    return header.width, header.height
+
+def _render_srcset(src: str, outputs: list, quality: int) -> dict:
+    """Write every (width, format, dest) in outputs from one decode of src."""
+    _check_pixel_limit(src)
+    started = time.perf_counter()
+    by_width = {}
+    for width, format, dest in outputs:
+        by_width.setdefault(width, []).append((format, dest))
+    largest = max(by_width)
+    # Shrink-on-load straight to the largest width, then keep it in memory for the rest
+    image = pyvips.Image.thumbnail(src, largest, height=VIPS_MAX_COORD).copy_memory()
+    decoded = time.perf_counter()
+
+    def encode(width: int) -> None:
+        resized = image if width == largest else image.thumbnail_image(width, height=VIPS_MAX_COORD)
+        if len(by_width[width]) > 1:
+            resized = resized.copy_memory()
+        for format, dest in by_width[width]:
+            resized.write_to_file(dest, **_encode_options(format, quality))
+
+    # libvips releases the GIL, so the widths encode in parallel
+    with ThreadPoolExecutor(max_workers=max(1, min(len(by_width), SRCSET_ENCODE_THREADS))) as encoders:
+        list(encoders.map(encode, by_width))
+    return {"decode": decoded - started, "encode": time.perf_counter() - decoded}
+
+async def _render_srcset_locked(original_full_path: Path, outputs: list, quality: int) -> int:
+    """Render the (width, format, cache_path) outputs that don't exist yet, returning how many that was."""
+    fd = await _acquire_render_lock(f"srcset:{original_full_path}")
+    temp_paths = []
+    try:
+        # Rechecked under the lock: another request or worker may have rendered them
+        missing = [output for output in outputs if not output[2].exists()]
+        if not missing:
+            return 0
+        CACHE_STATS["misses"] += len(missing)
+        CACHE_LOOKUPS.labels("process", "miss").inc(len(missing))
+        for _, _, cache_path in missing:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_paths.append(_temp_path_for(cache_path))
+        timings = await run_render(
+            "image", _render_srcset, str(original_full_path),
+            [(width, format, str(tmp)) for (width, format, _), tmp in zip(missing, temp_paths)], quality,
+        )
+        for (width, format, cache_path), tmp_path in zip(missing, temp_paths):
+            os.replace(tmp_path, cache_path)
+            await asyncio.to_thread(
+                _record_derivative, cache_path, _original_rel_path(original_full_path), "process",
+                {"render": "_render_resized_image", "args": [width, 0, quality, format, "fill"]},
+            )
+        record_timings("srcset", timings)
+        return len(missing)
+    finally:
+        for tmp_path in temp_paths:
+            tmp_path.unlink(missing_ok=True)
+        if fd is not None:
+            _release_file_lock(fd)
+
+async def _srcset_plan(original_full_path: Path, widths: list, formats: list, quality: int) -> tuple:
+    """The srcset manifest for one original, and the (width, format, cache_path) outputs behind it."""
+    rel_path = _original_rel_path(original_full_path)
+    display_width, display_height = await asyncio.to_thread(_display_size, str(original_full_path))
+    # No upscaling past the original, but always at least one candidate
+    widths = [width for width in widths if width <= display_width] or widths[:1]
+    cache_key = await _content_key(original_full_path) or rel_path
+    sha256 = await asyncio.to_thread(_indexed_sha256, rel_path)
+    version = sha256[:12] if sha256 else None
+
+    outputs, sources = [], []
+    for format in formats:
+        urls = []
+        for width in widths:
+            outputs.append((width, format, _processed_cache_path(cache_key, width, 0, quality, format)))
+            urls.append(_versioned(
+                f"{VPS_BASE_URL}/process/{width}/0/{quote(rel_path)}?quality={quality}&format={format}", version
+            ))
+        sources.append({
+            "type": IMAGE_OUTPUT_FORMATS[format][0],
+            "format": format,
+            "srcset": ", ".join(f"{url} {width}w" for url, width in zip(urls, widths)),
+        })
+
+    # The last format is the most widely supported, so it is the <img> fallback
+    fallback_width = widths[-1]
+    manifest = {
+        "image": rel_path,
+        "width": display_width,
+        "height": display_height,
+        "widths": widths,
+        "sources": sources,
+        "src": urls[-1],
+        "src_width": fallback_width,
+        "src_height": max(1, round(display_height * fallback_width / display_width)),
+    }
+    return manifest, outputs
+
+async def pregenerate_srcset(rel_path: str) -> None:
+    """Render the configured srcset of a new upload in the background."""
+    try:
+        _, outputs = await _srcset_plan(ORIGINALS_DIR / rel_path, SRCSET_WIDTHS, SRCSET_FORMATS, 80)
+        await _render_srcset_locked(ORIGINALS_DIR / rel_path, outputs, 80)
+    except Exception as e:
+        print(f"srcset pre-generation failed for {rel_path}: {e}")
+
+@app.get("/srcset/{image_path:path}")
+async def generate_srcset(
+    image_path: str,
+    widths: Optional[str] = Query(None, description="Comma-separated widths (default SRCSET_WIDTHS)"),
+    formats: Optional[str] = Query(None, description="Comma-separated formats, most preferred first"),
+    quality: int = Query(80, ge=1, le=100),
+):
+    """Render every width in every format from one decode and return a ready-to-use srcset manifest."""
+    try:
+        width_list = _parse_srcset_widths(widths) if widths else SRCSET_WIDTHS
+        format_list = _parse_srcset_formats(formats) if formats else SRCSET_FORMATS
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    for width in width_list:
+        _check_variant_size(width, 0, ALLOWED_PROCESS_SIZES)
+
+    original_full_path = (ORIGINALS_DIR / image_path).resolve()
+
+    if not _safe_within_base(original_full_path):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not original_full_path.exists():
+        raise HTTPException(status_code=404, detail="Original image not found")
+    if get_file_type(original_full_path.name) != "image":
+        raise HTTPException(status_code=422, detail="Not an image")
+
+    try:
+        manifest, outputs = await _srcset_plan(original_full_path, width_list, format_list, quality)
+        rendered = 0
+        if not all(cache_path.exists() for _, _, cache_path in outputs):
+            # Shielded so a client disconnect doesn't abandon a render others wait on
+            rendered = await asyncio.shield(
+                asyncio.ensure_future(_render_srcset_locked(original_full_path, outputs, quality))
+            )
+        manifest["rendered"] = rendered
+        return manifest
+
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"srcset error: {str(e)}")
 
 # ---------------------------
 # Video Processing (Enhanced)
@@ -276,11 +2539,58 @@ def _resolve_video_original_path(base_dir: Path, safe_video_path: str) -> Path:
         return direct
     raise FileNotFoundError
 
+def _video_thumb_cache_path(safe_video_path: str, width: int, height: int, timestamp: str) -> Path:
+    return _derivative_path(
+        (CACHE_DIR / "video_thumb" / f"{width}x{height}" / f"t{timestamp}" / f"{safe_video_path}.jpg").resolve(),
+        "video_thumb", safe_video_path, ".jpg", width=width, height=height, timestamp=timestamp,
+    )
+
+VIDEO_TIMESTAMP_REGEX = r"^\d+(:\d{1,2}){0,2}(\.\d+)?$"
+
+def _parse_size(size: str) -> tuple:
+    width_str, height_str = size.lower().split("x", 1)
+    width, height = int(width_str), int(height_str)
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid size '{size}'")
+    return width, height
+
+def _video_fill_filter(width: int, height: int) -> str:
+    return f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height},setsar=1"
+
+def _render_video_thumbnail(src: str, dest: str, width: int, height: int, timestamp: str, ffmpeg_bin: str) -> dict:
+    command = [
+        ffmpeg_bin,
+        "-ss", timestamp,  # Input-side seek: jump to the keyframe instead of decoding from the start
+        "-i", src,
+        "-vframes", "1",
+        "-vf", _video_fill_filter(width, height),
+        "-qscale:v", "2",
+        "-y",  # Overwrite output file
+        dest,
+    ]
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg error: {result.stderr}")
+    return {"ffmpeg": time.perf_counter() - started}
+
+def _video_original_or_404(video_path: str) -> tuple:
+    decoded_path = unquote(unquote(video_path))
+    safe_video_path = _sanitize_video_path(decoded_path)
+    try:
+        original_full_path = _resolve_video_original_path(ORIGINALS_DIR, safe_video_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Original video not found")
+    if not _safe_within_base(original_full_path):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return safe_video_path, original_full_path
+
 @app.get("/process/video/thumbnail/{size}/{video_path:path}")
 async def generate_video_thumbnail(
     size: str,
     video_path: str,
-    timestamp: str = Query("00:00:01", description="Timestamp for thumbnail (HH:MM:SS)")
+    timestamp: str = Query("00:00:01", regex=VIDEO_TIMESTAMP_REGEX, description="Timestamp for thumbnail (HH:MM:SS)")
 ):
     try:
         width_str, height_str = size.lower().split("x", 1)
@@ -289,129 +2599,383 @@ async def generate_video_thumbnail(
     except Exception:
         raise HTTPException(status_code=422, detail="Invalid size format. Use {width}x{height}")
 
-    decoded_path = unquote(unquote(video_path))
-    safe_video_path = _sanitize_video_path(decoded_path)
-
-    try:
-        original_full_path = _resolve_video_original_path(ORIGINALS_DIR, safe_video_path)
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Original video not found")
-
-    if not _safe_within_base(original_full_path):
-        raise HTTPException(status_code=403, detail="Forbidden")
+    hot_key = ("video_thumb", video_path, width, height, timestamp)
+    hot = hot_response(hot_key)
+    if hot is not None:
+        return hot
 
-    cache_full_path = (CACHE_DIR / f"video_thumb_{width}x{height}_{safe_video_path}.jpg").resolve()
-    cache_full_path.parent.mkdir(parents=True, exist_ok=True)
+    safe_video_path, original_full_path = _video_original_or_404(video_path)
+    cache_key = await _content_key(original_full_path) or safe_video_path
+    cache_full_path = _video_thumb_cache_path(cache_key, width, height, timestamp)
 
     if cache_full_path.exists():
-        return FileResponse(cache_full_path, media_type="image/jpeg")
+        return cached_file_response(cache_full_path, "image/jpeg", original_full_path, hot_key)
 
     try:
         ffmpeg_bin = _resolve_ffmpeg_binary()
-        command = [
-            ffmpeg_bin, "-i", str(original_full_path),
-            "-ss", timestamp,
-            "-vframes", "1",
-            "-vf", f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}",
-            "-qscale:v", "2",
-            "-y",  # Overwrite output file
-            str(cache_full_path),
-        ]
-        result = subprocess.run(command, capture_output=True, text=True)
-
-        if result.returncode != 0:
-            raise Exception(f"FFmpeg error: {result.stderr}")
-
-        return FileResponse(cache_full_path, media_type="image/jpeg")
+        await render_once(
+            cache_full_path, "video_thumb", "video", _render_video_thumbnail,
+            str(original_full_path), width, height, timestamp, ffmpeg_bin,
+        )
+        return file_response(cache_full_path, "image/jpeg", original_full_path)
+    except ServiceOverloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Video thumbnail error: {str(e)}")
 
 # ---------------------------
-# PDF Processing
+# Video Batch Frames & Storyboard
 # ---------------------------
-@app.get("/process/pdf/thumbnail/{size}/{pdf_path:path}")
-async def generate_pdf_thumbnail(
+def _video_input_args(src: str, timestamps: list) -> list:
+    # One seeked input per timestamp, so each frame costs a keyframe seek, not a decode from the start
+    args = []
+    for timestamp in timestamps:
+        args += ["-ss", str(timestamp), "-i", src]
+    return args
+
+def _run_ffmpeg(command: list) -> dict:
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg error: {result.stderr}")
+    return {"ffmpeg": time.perf_counter() - started}
+
+def _render_video_frames(src: str, outputs: list, ffmpeg_bin: str) -> dict:
+    """Write every (timestamp, width, height, dest) in outputs from one ffmpeg run."""
+    timestamps = list(dict.fromkeys(timestamp for timestamp, _, _, _ in outputs))
+    filters, output_args = [], []
+    for input_index, timestamp in enumerate(timestamps):
+        targets = [output for output in outputs if output[0] == timestamp]
+        labels = [f"[s{input_index}_{n}]" for n in range(len(targets))]
+        filters.append(f"[{input_index}:v]split={len(targets)}{''.join(labels)}")
+        for label, (_, width, height, dest) in zip(labels, targets):
+            out_label = f"[o{len(output_args)}]"
+            filters.append(f"{label}{_video_fill_filter(width, height)}{out_label}")
+            output_args.append(["-map", out_label, "-frames:v", "1", "-qscale:v", "2", dest])
+
+    command = [ffmpeg_bin, *_video_input_args(src, timestamps), "-filter_complex", ";".join(filters)]
+    for args in output_args:
+        command += args
+    return _run_ffmpeg(command + ["-y"])
+
+def _render_video_storyboard(src: str, dest: str, width: int, height: int, frames: int, columns: int,
+                             duration: float, ffmpeg_bin: str) -> dict:
+    # Evenly spaced frames, taken from the middle of each slice of the timeline
+    timestamps = [f"{duration * (i + 0.5) / frames:.3f}" for i in range(frames)]
+    rows = math.ceil(frames / columns)
+
+    filters = [
+        f"[{i}:v]trim=end_frame=1,{_video_fill_filter(width, height)},setpts=N/TB[f{i}]"
+        for i in range(frames)
+    ]
+    filters.append(
+        "".join(f"[f{i}]" for i in range(frames))
+        + f"concat=n={frames}:v=1:a=0,tile={columns}x{rows}:padding=4:color=white[sheet]"
+    )
+    timings = _run_ffmpeg([
+        ffmpeg_bin, *_video_input_args(src, timestamps),
+        "-filter_complex", ";".join(filters),
+        "-map", "[sheet]", "-frames:v", "1", "-qscale:v", "3", "-y", dest,
+    ])
+    return timings
+
+def _video_storyboard_cache_path(safe_video_path: str, width: int, height: int, frames: int, columns: int) -> Path:
+    spec_dir = CACHE_DIR / "video_storyboard" / f"{width}x{height}" / f"n{frames}c{columns}"
+    path_layout = spec_dir / f"{safe_video_path}.jpg"
+    return _derivative_path(
+        path_layout.resolve(),
+        "video_storyboard", safe_video_path, ".jpg", width=width, height=height, frames=frames, columns=columns,
+    )
+
+async def _render_video_frames_locked(original_full_path: Path, outputs: list) -> int:
+    """Render the (timestamp, width, height, cache_path) frames that don't exist yet, returning how many that was."""
+    fd = await _acquire_render_lock(f"video_thumbs:{original_full_path}")
+    temp_paths = []
+    try:
+        # Rechecked under the lock: another request or worker may have rendered them
+        missing = [output for output in outputs if not output[3].exists()]
+        if not missing:
+            return 0
+        CACHE_STATS["misses"] += len(missing)
+        CACHE_LOOKUPS.labels("video_thumb", "miss").inc(len(missing))
+        for _, _, _, cache_path in missing:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_paths.append(_temp_path_for(cache_path))
+        timings = await run_render(
+            "video", _render_video_frames, str(original_full_path),
+            [(t, w, h, str(tmp)) for (t, w, h, _), tmp in zip(missing, temp_paths)],
+            _resolve_ffmpeg_binary(),
+        )
+        # A concurrent single-frame render of the same path just replaces it atomically
+        for (timestamp, width, height, cache_path), tmp_path in zip(missing, temp_paths):
+            os.replace(tmp_path, cache_path)
+            await asyncio.to_thread(
+                _record_derivative, cache_path, _original_rel_path(original_full_path), "video_thumb",
+                {"render": "_render_video_frames", "args": [width, height, timestamp]},
+            )
+        record_timings("video_thumb", timings)
+        return len(missing)
+    finally:
+        for tmp_path in temp_paths:
+            tmp_path.unlink(missing_ok=True)
+        if fd is not None:
+            _release_file_lock(fd)
+
+@app.get("/process/video/thumbnails/{video_path:path}")
+async def generate_video_thumbnails(
+    video_path: str,
+    sizes: str = Query("300x300", description="Sizes (comma-separated WxH)"),
+    timestamps: str = Query("00:00:01", description="Timestamps (comma-separated, HH:MM:SS or seconds)")
+):
+    """Render every size at every timestamp with one ffmpeg run; each frame is cached on its own."""
+    try:
+        size_list = list(dict.fromkeys(_parse_size(size) for size in sizes.split(",")))
+        timestamp_list = list(dict.fromkeys(t.strip() for t in timestamps.split(",")))
+    except Exception:
+        raise HTTPException(status_code=422, detail="Invalid size format. Use {width}x{height}")
+    if any(not re.match(VIDEO_TIMESTAMP_REGEX, t) for t in timestamp_list):
+        raise HTTPException(status_code=422, detail="Invalid timestamp")
+    if len(size_list) * len(timestamp_list) > VIDEO_BATCH_MAX_FRAMES:
+        raise HTTPException(status_code=422, detail=f"At most {VIDEO_BATCH_MAX_FRAMES} frames per batch")
+
+    safe_video_path, original_full_path = _video_original_or_404(video_path)
+    cache_key = await _content_key(original_full_path) or safe_video_path
+
+    frames = []
+    missing = []
+    for timestamp in timestamp_list:
+        for width, height in size_list:
+            cache_full_path = _video_thumb_cache_path(cache_key, width, height, timestamp)
+            frames.append({
+                "size": f"{width}x{height}",
+                "timestamp": timestamp,
+                "url": (
+                    f"{VPS_BASE_URL}/process/video/thumbnail/{width}x{height}/{quote(video_path)}"
+                    f"?timestamp={quote(timestamp)}"
+                ),
+            })
+            if not cache_full_path.exists():
+                missing.append((timestamp, width, height, cache_full_path))
+
+    rendered = 0
+    if missing:
+        key = "video_thumbs:" + "|".join(str(cache_full_path) for *_, cache_full_path in missing)
+        try:
+            rendered = await _join_inflight(key, lambda: _render_video_frames_locked(original_full_path, missing))
+        except ServiceOverloaded:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Video thumbnail error: {str(e)}")
+
+    return {"video": video_path, "rendered": rendered, "thumbnails": frames}
+
+@app.get("/process/video/storyboard/{size}/{video_path:path}")
+async def generate_video_storyboard(
     size: str,
-    pdf_path: str,
-    page: int = Query(0, description="Page number (0-based)")
+    video_path: str,
+    frames: int = Query(10, ge=1, description="Evenly spaced frames across the video"),
+    columns: int = Query(5, ge=1, le=20, description="Frames per row")
 ):
     try:
-        width_str, height_str = size.lower().split("x", 1)
-        width = int(width_str)
-        height = int(height_str)
+        width, height = _parse_size(size)
     except Exception:
         raise HTTPException(status_code=422, detail="Invalid size format. Use {width}x{height}")
+    if frames > VIDEO_BATCH_MAX_FRAMES:
+        raise HTTPException(status_code=422, detail=f"At most {VIDEO_BATCH_MAX_FRAMES} frames per storyboard")
+    columns = min(columns, frames)
 
-    original_full_path = (ORIGINALS_DIR / pdf_path).resolve()
-
-    if not _safe_within_base(original_full_path):
-        raise HTTPException(status_code=403, detail="Forbidden")
-    if not original_full_path.exists():
-        raise HTTPException(status_code=404, detail="Original PDF not found")
-
-    cache_full_path = (CACHE_DIR / f"pdf_thumb_{width}x{height}_{pdf_path}_page{page}.jpg").resolve()
-    cache_full_path.parent.mkdir(parents=True, exist_ok=True)
+    safe_video_path, original_full_path = _video_original_or_404(video_path)
+    cache_key = await _content_key(original_full_path) or safe_video_path
+    cache_full_path = _video_storyboard_cache_path(cache_key, width, height, frames, columns)
 
     if cache_full_path.exists():
-        return FileResponse(cache_full_path, media_type="image/jpeg")
+        return cached_file_response(cache_full_path, "image/jpeg", original_full_path)
 
     try:
-        # Open PDF and get specified page
-        pdf_document = fitz.open(original_full_path)
+        # From the cached ffprobe metadata, so a storyboard doesn't probe the file again
+        duration = (await video_metadata(original_full_path)).get("duration")
+        if not duration:
+            raise ValueError("Could not determine video duration")
+        await render_once(
+            cache_full_path, "video_storyboard", "video", _render_video_storyboard,
+            str(original_full_path), width, height, frames, columns, duration, _resolve_ffmpeg_binary(),
+        )
+        return file_response(cache_full_path, "image/jpeg", original_full_path)
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Video storyboard error: {str(e)}")
 
+# ---------------------------
+# PDF Processing
+# ---------------------------
+def _pdf_thumb_cache_path(pdf_path: str, width: int, height: int, page: int) -> Path:
+    return _derivative_path(
+        (CACHE_DIR / "pdf_thumb" / f"{width}x{height}" / f"p{page}" / f"{pdf_path}.jpg").resolve(),
+        "pdf_thumb", pdf_path, ".jpg", width=width, height=height, page=page,
+    )
+
+_pdf_documents: OrderedDict = OrderedDict()
+_pdf_documents_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _open_pdf(src: str):
+    """Yield an open fitz.Document, reusing a recently opened one for the same file.
+
+    Handles are keyed on the file's identity so a replaced original is reopened,
+    and each is used by one render at a time (PyMuPDF documents are not thread-safe).
+    """
+    if PDF_DOCUMENT_CACHE_SIZE <= 0:
+        pdf_document = fitz.open(src)
+        try:
+            yield pdf_document
+        finally:
+            pdf_document.close()
+        return
+
+    stats = os.stat(src)
+    key = (src, stats.st_mtime_ns, stats.st_size)
+    with _pdf_documents_lock:
+        entry = _pdf_documents.pop(key, None)
+        if entry is None:
+            entry = (fitz.open(src), threading.Lock())
+        _pdf_documents[key] = entry
+        while len(_pdf_documents) > PDF_DOCUMENT_CACHE_SIZE:
+            _, (stale_document, stale_lock) = _pdf_documents.popitem(last=False)
+            with stale_lock:
+                stale_document.close()
+
+    pdf_document, lock = entry
+    with lock:
+        if pdf_document.is_closed:
+            # Evicted between lookup and use
+            with fitz.open(src) as pdf_document:
+                yield pdf_document
+        else:
+            yield pdf_document
+
+def _render_pdf_thumbnail(src: str, dest: str, width: int, height: int, page: int) -> dict:
+    started = time.perf_counter()
+    with _open_pdf(src) as pdf_document:
         if page >= len(pdf_document):
-            raise HTTPException(status_code=400, detail=f"Page {page} not found. PDF has {len(pdf_document)} pages.")
+            raise ValueError(f"Page {page} not found. PDF has {len(pdf_document)} pages.")
 
         pdf_page = pdf_document[page]
 
-        # Render page to image
-        mat = fitz.Matrix(2.0, 2.0)  # Zoom factor for better quality
-        pix = pdf_page.get_pixmap(matrix=mat)
+        # Rasterize straight at the scale that fits the page into the target box
+        rect = pdf_page.rect
+        zoom = min(width / rect.width, height / rect.height)
+        pix = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        rasterized = time.perf_counter()
 
-        # Convert to PIL Image for processing
-        img_data = pix.tobytes("ppm")
-        pil_image = PILImage.open(io.BytesIO(img_data))
+        # Hand the pixmap's sample buffer to libvips without copying it
+        image = pyvips.Image.new_from_memory(pix.samples_mv, pix.width, pix.height, pix.n, "uchar")
+        if pix.n == 1:
+            image = image.colourspace("srgb")
 
-        # Resize to target dimensions
-        pil_image.thumbnail((width, height), PILImage.Resampling.LANCZOS)
+        # Centre on a white background of the exact size (also trims rounding overshoot)
+        image = image.gravity("centre", width, height, extend="background", background=[255, 255, 255])
+
+        # Save as JPEG
+        image.write_to_file(dest, Q=85)
+        return {"pymupdf": rasterized - started, "encode": time.perf_counter() - rasterized}
+
+@app.get("/process/pdf/thumbnail/{size}/{pdf_path:path}")
+async def generate_pdf_thumbnail(
+    size: str,
+    pdf_path: str,
+    page: int = Query(0, ge=0, description="Page number (0-based)")
+):
+    try:
+        width, height = _parse_size(size)
+    except Exception:
+        raise HTTPException(status_code=422, detail="Invalid size format. Use {width}x{height}")
 
-        # Create background for exact size
-        background = PILImage.new('RGB', (width, height), (255, 255, 255))
+    hot_key = ("pdf_thumb", pdf_path, width, height, page)
+    hot = hot_response(hot_key)
+    if hot is not None:
+        return hot
 
-        # Calculate position to center the image
-        img_width, img_height = pil_image.size
-        x = (width - img_width) // 2
-        y = (height - img_height) // 2
+    original_full_path = (ORIGINALS_DIR / pdf_path).resolve()
 
-        # Paste image on background
-        background.paste(pil_image, (x, y))
+    if not _safe_within_base(original_full_path):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not original_full_path.exists():
+        raise HTTPException(status_code=404, detail="Original PDF not found")
 
-        # Save as JPEG
-        background.save(cache_full_path, "JPEG", quality=85)
+    cache_key = await _content_key(original_full_path) or pdf_path
+    cache_full_path = _pdf_thumb_cache_path(cache_key, width, height, page)
 
-        pdf_document.close()
+    if cache_full_path.exists():
+        return cached_file_response(cache_full_path, "image/jpeg", original_full_path, hot_key)
 
-        return FileResponse(cache_full_path, media_type="image/jpeg")
+    try:
+        await render_once(
+            cache_full_path, "pdf_thumb", "pdf", _render_pdf_thumbnail,
+            str(original_full_path), width, height, page,
+        )
+        return file_response(cache_full_path, "image/jpeg", original_full_path)
 
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"PDF thumbnail error: {str(e)}")
 
 # ---------------------------
-# PDF Preview (Multiple Pages)
+# PDF Preview (Contact Sheet)
 # ---------------------------
+def _parse_page_list(pages: str) -> list:
+    """Parse "0,2,5-8" into page numbers, keeping order and dropping repeats."""
+    page_numbers = []
+    for part in pages.split(","):
+        first, _, last = part.strip().partition("-")
+        for page in range(int(first), int(last or first) + 1):
+            if page not in page_numbers:
+                page_numbers.append(page)
+    return page_numbers
+
+def _render_pdf_contact_sheet(src: str, dest: str, tile_paths: list, columns: int, gap: int) -> dict:
+    # src is the PDF itself (recorded in the manifest); the pages are the cached tiles
+    started = time.perf_counter()
+    tiles = [pyvips.Image.new_from_file(path) for path in tile_paths]
+    sheet = pyvips.Image.arrayjoin(tiles, across=columns, shim=gap, background=[255, 255, 255])
+    sheet.write_to_file(dest, Q=85, optimize_coding=True)
+    return {"encode": time.perf_counter() - started}
+
+def _pdf_preview_cache_path(pdf_path: str, width: int, height: int, pages: list, columns: int, gap: int) -> Path:
+    pages_key = "_".join(str(p) for p in pages)
+    if len(pages_key) > 64:
+        pages_key = hashlib.sha1(pages_key.encode()).hexdigest()[:16]
+    spec_dir = CACHE_DIR / "pdf_preview" / f"{width}x{height}" / f"p{pages_key}" / f"c{columns}g{gap}"
+    path_layout = spec_dir / f"{pdf_path}.jpg"
+    return _derivative_path(
+        path_layout.resolve(),
+        "pdf_preview", pdf_path, ".jpg", width=width, height=height, pages=pages, columns=columns, gap=gap,
+    )
+
 @app.get("/process/pdf/preview/{pdf_path:path}")
 async def generate_pdf_preview(
     pdf_path: str,
-    pages: str = Query("0", description="Page numbers (comma-separated, 0-based)"),
-    size: str = Query("300x300", description="Size for each page thumbnail")
+    pages: str = Query("0", description="Page numbers or ranges (comma-separated, 0-based), e.g. 0,2,5-8"),
+    size: str = Query("300x300", description="Size for each page thumbnail"),
+    columns: int = Query(0, ge=0, le=20, description="Pages per row (0 = roughly square grid)"),
+    gap: int = Query(8, ge=0, le=100, description="Pixels between pages")
 ):
     try:
         width_str, height_str = size.lower().split("x", 1)
         width = int(width_str)
         height = int(height_str)
-        page_numbers = [int(p.strip()) for p in pages.split(",")]
+        page_numbers = _parse_page_list(pages)
     except Exception:
         raise HTTPException(status_code=422, detail="Invalid parameters")
+    if width <= 0 or height <= 0 or not page_numbers or min(page_numbers) < 0:
+        raise HTTPException(status_code=422, detail="Invalid parameters")
+    if len(page_numbers) > PDF_PREVIEW_MAX_PAGES:
+        raise HTTPException(status_code=422, detail=f"At most {PDF_PREVIEW_MAX_PAGES} pages per preview")
 
     original_full_path = (ORIGINALS_DIR / pdf_path).resolve()
 
@@ -420,49 +2984,428 @@ async def generate_pdf_preview(
     if not original_full_path.exists():
         raise HTTPException(status_code=404, detail="Original PDF not found")
 
-    # Create a unique cache key for this preview
-    pages_key = "_".join(str(p) for p in page_numbers)
-    cache_full_path = (CACHE_DIR / f"pdf_preview_{width}x{height}_{pdf_path}_pages{pages_key}.jpg").resolve()
-    cache_full_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_key = await _content_key(original_full_path) or pdf_path
+    cache_full_path = _pdf_preview_cache_path(cache_key, width, height, page_numbers, columns, gap)
 
     if cache_full_path.exists():
-        return FileResponse(cache_full_path, media_type="image/jpeg")
+        return cached_file_response(cache_full_path, "image/jpeg", original_full_path)
 
     try:
-        pdf_document = fitz.open(original_full_path)
-
-        # Create a combined image for all requested pages
-        preview_images = []
-
-        for page_num in page_numbers:
-            if page_num >= len(pdf_document):
-                continue
-
-            pdf_page = pdf_document[page_num]
-            mat = fitz.Matrix(1.5, 1.5)
-            pix = pdf_page.get_pixmap(matrix=mat)
+        # Each page is an ordinary pdf_thumb tile, so other page sets and the
+        # thumbnail route reuse them; missing tiles render in parallel on the
+        # pdf pool, each worker opening the document on its own.
+        tile_paths = {page: _pdf_thumb_cache_path(cache_key, width, height, page) for page in page_numbers}
+        missing = [page for page, path in tile_paths.items() if not path.exists()]
+        results = await asyncio.gather(
+            *(
+                render_once(
+                    tile_paths[page], "pdf_thumb", "pdf", _render_pdf_thumbnail,
+                    str(original_full_path), width, height, page,
+                )
+                for page in missing
+            ),
+            return_exceptions=True,
+        )
+        for page, result in zip(missing, results):
+            if isinstance(result, ValueError):
+                # Pages past the end of the document are skipped
+                del tile_paths[page]
+            elif isinstance(result, BaseException):
+                raise result
+        if not tile_paths:
+            raise ValueError("No valid pages found")
+
+        sheet_columns = columns or math.ceil(math.sqrt(len(tile_paths)))
+        await render_once(
+            cache_full_path, "pdf_preview", "image", _render_pdf_contact_sheet,
+            str(original_full_path), [str(path) for path in tile_paths.values()],
+            min(sheet_columns, len(tile_paths)), gap,
+        )
+        return file_response(cache_full_path, "image/jpeg", original_full_path)
 
-            img_data = pix.tobytes("ppm")
-            pil_image = PILImage.open(io.BytesIO(img_data))
-            pil_image.thumbnail((width, height), PILImage.Resampling.LANCZOS)
+    except ServiceOverloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF preview error: {str(e)}")
 
-            preview_images.append(pil_image)
+# ---------------------------
+# Eager Pre-generation
+# ---------------------------
+def _pregeneration_jobs(rel_path: str, file_type: str, content_key: Optional[str] = None) -> list:
+    """Derivatives worth rendering right after upload, as render_once() arguments."""
+    key = content_key or rel_path
+    jobs = []
+    if file_type == "image":
+        width, height = DEFAULT_PROCESSED_SIZE
+        jobs.append((_processed_cache_path(key, width, height, 80, "webp"), "process", "image",
+                     _render_resized_image, width, height, 80, "webp"))
+        width, height = DEFAULT_THUMBNAIL_SIZE
+        jobs.append((_thumbnail_cache_path(key, width, height, 80, "webp"), "thumbnail", "image",
+                     _render_image_thumbnail, width, height, 80, "webp"))
+        for variant in MEDIA_VARIANTS.values():
+            width, height, quality = variant["width"], variant["height"], variant["quality"]
+            if variant["thumbnail"]:
+                jobs.append((_thumbnail_cache_path(key, width, height, quality, variant["format"]),
+                             "thumbnail", "image", _render_image_thumbnail, width, height, quality, variant["format"]))
+            else:
+                jobs.append((_processed_cache_path(key, width, height, quality, variant["format"], variant["fit"]),
+                             "process", "image", _render_resized_image, width, height, quality, variant["format"],
+                             variant["fit"]))
+    elif file_type == "pdf":
+        for width, height in (DEFAULT_PROCESSED_SIZE, DEFAULT_THUMBNAIL_SIZE):
+            jobs.append((_pdf_thumb_cache_path(key, width, height, 0), "pdf_thumb", "pdf",
+                         _render_pdf_thumbnail, width, height, 0))
+    elif file_type == "video":
+        ffmpeg_bin = _resolve_ffmpeg_binary()
+        safe_video_path = content_key or _sanitize_video_path(rel_path)
+        for width, height in (DEFAULT_PROCESSED_SIZE, DEFAULT_THUMBNAIL_SIZE):
+            jobs.append((_video_thumb_cache_path(safe_video_path, width, height, "00:00:01"), "video_thumb", "video",
+                         _render_video_thumbnail, width, height, "00:00:01", ffmpeg_bin))
+    return jobs
+
+async def pregenerate_derivatives(rel_path: str, file_type: str) -> list:
+    """Render the upload-time derivatives of one original, returning (and printing) any errors."""
+    src = str(ORIGINALS_DIR / rel_path)
+    try:
+        jobs = _pregeneration_jobs(rel_path, file_type, await _content_key(ORIGINALS_DIR / rel_path))
+    except Exception as e:
+        print(f"Pre-generation skipped for {rel_path}: {e}")
+        return [f"{rel_path}: {e}"]
+
+    errors = []
+    for cache_path, kind, pool, func, *args in jobs:
+        if cache_path.exists():
+            continue
+        try:
+            await render_once(cache_path, kind, pool, func, src, *args)
+        except Exception as e:
+            print(f"Pre-generation failed for {cache_path}: {e}")
+            errors.append(f"{cache_path.name}: {e}")
+    return errors
 
-        if not preview_images:
-            raise HTTPException(status_code=400, detail="No valid pages found")
+# ---------------------------
+# Job Queue
+# ---------------------------
+# Jobs live in the index DB, so they survive restarts and any uvicorn worker can
+# accept them; only the maintenance leader runs them.
+#   render:   {"url": "/process/pdf/preview/docs/a.pdf?pages=0-20"} - any GET under
+#             /process/, /thumbnail/ or /transform/, rendered into the cache
+#   variants: {"paths": ["news/a.jpg", ...]} - the upload-time derivatives for each path
+JOB_TYPES = ("render", "variants")
+JOB_RENDER_PREFIXES = ("/process/", "/thumbnail/", "/transform/")
+
+_jobs_wakeup = asyncio.Event()
+
+def _job_dict(row: sqlite3.Row) -> dict:
+    job = {
+        "id": row["id"],
+        "type": row["type"],
+        "params": json.loads(row["params"]),
+        "priority": row["priority"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "error": row["error"],
+        "status_url": f"{VPS_BASE_URL}/jobs/{row['id']}",
+        "result_url": f"{VPS_BASE_URL}/jobs/{row['id']}/result",
+    }
+    if row["status"] == "queued" and row["attempts"]:
+        job["retry_at"] = row["run_after"]
+    return job
 
-        # Create combined preview (for now, just return first page)
-        # You can enhance this to create a grid of multiple pages
-        combined_image = preview_images[0]
+def _route_scope(path: str, query: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": quote(path).encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [],
+        "client": None,
+        "server": None,
+        "app": app,
+    }
 
-        # Save combined preview
-        combined_image.save(cache_full_path, "JPEG", quality=85)
-        pdf_document.close()
+def _canonical_job_params(job_type: str, params: dict) -> dict:
+    """Validate a job's params and normalise them, so identical specs dedupe."""
+    if job_type == "render":
+        url = params.get("url")
+        if not isinstance(url, str):
+            raise HTTPException(status_code=422, detail="render jobs need a url")
+        parts = urlsplit(url)
+        path = unquote(parts.path)
+        if not path.startswith(JOB_RENDER_PREFIXES):
+            raise HTTPException(status_code=422, detail=f"Only {', '.join(JOB_RENDER_PREFIXES)} URLs can be queued")
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        scope = _route_scope(path, query)
+        if not any(route.matches(scope)[0] == Match.FULL for route in app.router.routes):
+            raise HTTPException(status_code=422, detail="No such render route")
+        return {"url": quote(path) + (f"?{query}" if query else "")}
+
+    if job_type == "variants":
+        paths = params.get("paths")
+        if not isinstance(paths, list) or not paths or not all(isinstance(p, str) for p in paths):
+            raise HTTPException(status_code=422, detail="variants jobs need a list of paths")
+        rel_paths = set()
+        for asset_path in paths:
+            original_full_path = (ORIGINALS_DIR / unquote(asset_path)).resolve()
+            if not _safe_within_base(original_full_path) or original_full_path == ORIGINALS_DIR:
+                raise HTTPException(status_code=403, detail=f"Forbidden: {asset_path}")
+            rel_paths.add(_original_rel_path(original_full_path))
+        return {"paths": sorted(rel_paths)}
+
+    raise HTTPException(status_code=422, detail=f"Unknown job type. Supported: {', '.join(JOB_TYPES)}")
+
+def _submit_job(job_type: str, params: dict, priority: int) -> sqlite3.Row:
+    spec_key = hashlib.sha1(json.dumps([job_type, params], sort_keys=True).encode()).hexdigest()
+    now = time.time()
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Ignored while an identical job is queued or running (jobs_active_spec); a done
+        # or failed one gets a fresh job, which re-renders whatever is no longer cached
+        conn.execute(
+            "INSERT OR IGNORE INTO jobs (id, spec_key, type, params, priority, status, run_after, created_at) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (uuid.uuid4().hex, spec_key, job_type, json.dumps(params), priority, now, now),
+        )
+        # A waiting duplicate takes the higher priority
+        conn.execute(
+            "UPDATE jobs SET priority = MAX(priority, ?) WHERE spec_key = ? AND status = 'queued'",
+            (priority, spec_key),
+        )
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE spec_key = ? AND status IN ('queued', 'running')", (spec_key,)
+        ).fetchone()
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+def _get_job(job_id: str) -> Optional[sqlite3.Row]:
+    return _db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+def _claim_job() -> Optional[sqlite3.Row]:
+    now = time.time()
+    rows = _db().execute(
+        "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? "
+        "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? "
+        "ORDER BY priority DESC, created_at LIMIT 1) AND status = 'queued' RETURNING *",
+        (now, now),
+    ).fetchall()
+    return rows[0] if rows else None
+
+def _finish_job(job_id: str, result: dict) -> None:
+    _db().execute(
+        "UPDATE jobs SET status = 'done', finished_at = ?, result = ?, error = NULL WHERE id = ?",
+        (time.time(), json.dumps(result), job_id),
+    )
 
-        return FileResponse(cache_full_path, media_type="image/jpeg")
+def _fail_job(job_id: str, error: str, retry_at: Optional[float]) -> None:
+    if retry_at is None:
+        _db().execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE id = ?",
+            (time.time(), error, job_id),
+        )
+    else:
+        _db().execute(
+            "UPDATE jobs SET status = 'queued', run_after = ?, error = ? WHERE id = ?",
+            (retry_at, error, job_id),
+        )
 
+def _requeue_orphaned_jobs() -> int:
+    # Jobs a previous leader was running when it died
+    return _db().execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+def _prune_jobs() -> int:
+    return _db().execute(
+        "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+        (time.time() - JOB_RETENTION,),
+    ).rowcount
+
+def _job_counts() -> dict:
+    rows = _db().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    return {row["status"]: row["n"] for row in rows}
+
+async def _run_render_job(params: dict) -> dict:
+    """GET the URL through the app in this process, rendering it into the cache."""
+    parts = urlsplit(params["url"])
+    response = {"status": 500, "content_type": "", "body": b""}
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses listen for a disconnect; only "hang up" once it is all sent
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["content_type"] = Headers(raw=message.get("headers", [])).get("content-type", "")
+        elif message["type"] == "http.response.body":
+            # File bodies are dropped; only JSON answers (and errors) are kept
+            if response["content_type"] == "application/json":
+                response["body"] += message.get("body", b"")
+            if not message.get("more_body", False):
+                response_done.set()
+
+    await app(_route_scope(unquote(parts.path), parts.query), receive, send)
+
+    data = json.loads(response["body"]) if response["body"] else None
+    if response["status"] >= 400:
+        detail = data.get("detail") if isinstance(data, dict) else None
+        raise HTTPException(status_code=response["status"], detail=detail or "Render failed")
+    result = {"url": f"{VPS_BASE_URL}{params['url']}", "status": response["status"]}
+    if data is not None:
+        result["data"] = data
+    return result
+
+async def _run_variants_job(params: dict) -> dict:
+    assets, missing, errors = {}, [], []
+    for rel_path in params["paths"]:
+        if not (ORIGINALS_DIR / rel_path).is_file():
+            missing.append(rel_path)
+            continue
+        file_type = get_file_type(rel_path)
+        errors += await pregenerate_derivatives(rel_path, file_type)
+        sha256 = await asyncio.to_thread(_indexed_sha256, rel_path)
+        assets[rel_path] = _asset_urls(rel_path, file_type, sha256)
+    if errors:
+        # Finished derivatives stay cached, so a retry only redoes the failures
+        raise RuntimeError("; ".join(errors[:5]))
+    return {"assets": assets, "missing": missing}
+
+JOB_RUNNERS = {
+    "render": _run_render_job,
+    "variants": _run_variants_job,
+}
+
+def _job_error(e: Exception) -> tuple:
+    """(message, permanent): bad requests fail at once, anything else is retried."""
+    if isinstance(e, HTTPException):
+        return f"{e.status_code}: {e.detail}", e.status_code < 500
+    return str(e) or type(e).__name__, False
+
+async def _run_job(job: sqlite3.Row) -> None:
+    try:
+        result = await JOB_RUNNERS[job["type"]](json.loads(job["params"]))
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"PDF preview error: {str(e)}")
+        error, permanent = _job_error(e)
+        if permanent or job["attempts"] >= JOB_MAX_ATTEMPTS:
+            JOB_OUTCOMES.labels(job["type"], "failed").inc()
+            await asyncio.to_thread(_fail_job, job["id"], error, None)
+        else:
+            JOB_OUTCOMES.labels(job["type"], "retried").inc()
+            retry_at = time.time() + JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+            await asyncio.to_thread(_fail_job, job["id"], error, retry_at)
+        return
+    JOB_OUTCOMES.labels(job["type"], "done").inc()
+    await asyncio.to_thread(_finish_job, job["id"], result)
+
+async def _job_worker() -> None:
+    _batch_render.set(True)
+    while True:
+        try:
+            job = await asyncio.to_thread(_claim_job)
+        except Exception as e:
+            print(f"Job claim failed: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(_jobs_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _jobs_wakeup.clear()
+            continue
+        try:
+            await _run_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Left "running"; requeued when the next leader starts
+            print(f"Job {job['id']} bookkeeping failed: {e}")
+
+async def _job_queue_loop():
+    if JOB_WORKERS <= 0:
+        return
+    # Any worker may take over the queue when the leader goes away
+    while not is_maintenance_leader():
+        await asyncio.sleep(max(JOB_POLL_INTERVAL, 5))
+    await asyncio.to_thread(_requeue_orphaned_jobs)
+    workers = [asyncio.create_task(_job_worker()) for _ in range(JOB_WORKERS)]
+    try:
+        while True:
+            try:
+                await asyncio.to_thread(_prune_jobs)
+            except Exception as e:
+                print(f"Job prune failed: {e}")
+            await asyncio.sleep(3600)
+    finally:
+        for task in workers:
+            task.cancel()
+
+@app.on_event("startup")
+async def _start_job_queue():
+    _start_background(_job_queue_loop())
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    type: str = Body(..., embed=True),
+    params: dict = Body(..., embed=True),
+    priority: int = Body(0, embed=True, description="Higher runs first"),
+    api_key: str = Depends(verify_api_key),
+):
+    params = _canonical_job_params(type, params)
+    try:
+        row = await asyncio.to_thread(_submit_job, type, params, priority)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Job submit failed: {str(e)}")
+    _jobs_wakeup.set()
+    return _job_dict(row)
+
+@app.get("/jobs")
+async def job_queue_stats(api_key: str = Depends(verify_api_key)):
+    return {"workers": JOB_WORKERS, "jobs": await asyncio.to_thread(_job_counts)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, api_key: str = Depends(verify_api_key)):
+    row = await asyncio.to_thread(_get_job, job_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_dict(row)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, api_key: str = Depends(verify_api_key)):
+    row = await asyncio.to_thread(_get_job, job_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if row["status"] == "done":
+        return json.loads(row["result"])
+    if row["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {row['error']}")
+    retry_after = max(1, math.ceil(row["run_after"] - time.time())) if row["status"] == "queued" else JOB_POLL_INTERVAL
+    return Response(
+        content=json.dumps(_job_dict(row)),
+        status_code=202,
+        media_type="application/json",
+        headers={"Retry-After": str(max(1, retry_after))},
+    )
 
 # ---------------------------
 # File Information Endpoint
@@ -490,42 +3433,24 @@ async def get_file_info(file_path: str):
             "modified_time": file_stats.st_mtime,
         }
 
-        # Add type-specific information
-        if file_type == "image":
-            try:
-                image = pyvips.Image.new_from_file(str(original_full_path))
-                info.update({
-                    "width": image.width,
-                    "height": image.height,
-                    "format": image.format,
-                    "bands": image.bands
-                })
-            except Exception:
-                pass
-
-        elif file_type == "pdf":
-            try:
-                pdf_document = fitz.open(original_full_path)
-                info.update({
-                    "page_count": len(pdf_document),
-                    "is_encrypted": pdf_document.is_encrypted
-                })
-                pdf_document.close()
-            except Exception:
-                pass
+        # Add type-specific information, from the index when it is current
+        if file_type in ("image", "pdf"):
+            meta = await asyncio.to_thread(_indexed_meta, _original_rel_path(original_full_path), file_stats)
+            if meta is None:
+                try:
+                    meta = await run_render(file_type, _probe_original, str(original_full_path), file_type, shed=False)
+                except Exception:
+                    meta = {}
+            if file_type == "image" and meta.get("width") is not None:
+                info.update({key: meta[key] for key in ("width", "height", "format", "bands")})
+            elif file_type == "pdf" and meta.get("page_count") is not None:
+                info.update({"page_count": meta["page_count"], "is_encrypted": bool(meta["is_encrypted"])})
 
         elif file_type == "video":
             try:
-                ffmpeg_bin = _resolve_ffmpeg_binary()
-                command = [
-                    ffmpeg_bin, "-i", str(original_full_path),
-                    "-hide_banner"
-                ]
-                result = subprocess.run(command, capture_output=True, text=True)
-                # Parse FFmpeg output for video info (simplified)
-                info["video_info"] = "Available (needs parsing)"
-            except Exception:
-                pass
+                info["video_info"] = await video_metadata(original_full_path)
+            except Exception as e:
+                info["video_info"] = {"error": f"Could not read video metadata: {str(e)}"}
 
         return info
 
@@ -535,8 +3460,34 @@ async def get_file_info(file_path: str):
 # ---------------------------
 # Delete Endpoint (Enhanced)
 # ---------------------------
+@app.post("/delete/_bulk")
+async def delete_assets_bulk(
+    paths: list = Body(..., embed=True),
+    api_key: str = Depends(verify_api_key),
+):
+    rel_paths = []
+    for asset_path in paths:
+        original_full_path = (ORIGINALS_DIR / unquote(str(asset_path))).resolve()
+        if not _safe_within_base(original_full_path) or original_full_path == ORIGINALS_DIR:
+            raise HTTPException(status_code=403, detail=f"Forbidden: {asset_path}")
+        rel_paths.append(_original_rel_path(original_full_path))
+
+    try:
+        deleted, deleted_cache = await asyncio.to_thread(_delete_originals, rel_paths)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Bulk delete failed: {str(e)}")
+    finally:
+        for rel_path in rel_paths:
+            HOT_CACHE.invalidate(rel_path)
+
+    return {"message": "Delete successful", "deleted_files": deleted, "deleted_cache_files": deleted_cache}
+
 @app.delete("/delete/{asset_path:path}")
-async def delete_asset(asset_path: str, api_key: str = Depends(verify_api_key)):
+async def delete_asset(
+    asset_path: str,
+    api_key: str = Depends(verify_api_key),
+    prefix: bool = Query(False, description="Delete everything under this section/folder"),
+):
     decoded = unquote(unquote(asset_path))
     original_full_path = (ORIGINALS_DIR / decoded).resolve()
 
@@ -545,121 +3496,123 @@ async def delete_asset(asset_path: str, api_key: str = Depends(verify_api_key)):
     if not original_full_path.exists():
         raise HTTPException(status_code=404, detail="Original file not found")
 
-    # Attempt to delete original
+    if prefix:
+        if not original_full_path.is_dir() or original_full_path == ORIGINALS_DIR:
+            raise HTTPException(status_code=400, detail="Prefix delete needs a section folder")
+        try:
+            deleted, deleted_cache = await asyncio.to_thread(
+                _delete_prefix, _original_rel_path(original_full_path)
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to delete section: {str(e)}")
+        finally:
+            HOT_CACHE.invalidate(_original_rel_path(original_full_path), prefix=True)
+        return {"message": "Delete successful", "deleted_files": deleted, "deleted_cache_files": deleted_cache}
+
+    # Delete the original and exactly the derivatives recorded for it
     try:
-        original_parent = original_full_path.parent
-        original_full_path.unlink()
-        _prune_empty_parents(original_parent, ORIGINALS_DIR)
+        _, deleted_cache = await asyncio.to_thread(
+            _delete_originals, [_original_rel_path(original_full_path)]
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete original: {str(e)}")
-
-    # Delete cached derivatives
-    deleted_cache = 0
-    try:
-        rel_decoded_posix = Path(decoded).as_posix()
-
-        # Build patterns for all cached file types
-        patterns = [
-            rel_decoded_posix,  # Original processed images
-            Path(rel_decoded_posix).with_suffix(".webp").as_posix(),
-            Path(rel_decoded_posix).with_suffix(".jpg").as_posix(),
-            Path(rel_decoded_posix).with_suffix(".png").as_posix(),
-        ]
-
-        # Add video thumbnail patterns
-        video_safe_stem = _sanitize_video_path(rel_decoded_posix)
-        patterns.append(f"{video_safe_stem}.jpg")
-
-        # Add PDF thumbnail patterns
-        patterns.append(f"pdf_thumb_.*_{rel_decoded_posix}.*\\.jpg")
-        patterns.append(f"pdf_preview_.*_{rel_decoded_posix}.*\\.jpg")
-
-        for p in CACHE_DIR.rglob("*"):
-            if not p.is_file():
-                continue
-            sp = p.as_posix()
-            if any(pattern in sp for pattern in patterns):
-                try:
-                    parent_dir = p.parent
-                    p.unlink()
-                    deleted_cache += 1
-                    _prune_empty_parents(parent_dir, CACHE_DIR)
-                except Exception:
-                    pass
-
-        # Clean thumbnails directory too
-        # Thumbnails are stored as: thumb_{width}x{height}_{image_path}.webp
-        # Only delete specific thumbnail files, not directories (like cache deletion)
-        for p in THUMBNAILS_DIR.rglob("*"):
-            if not p.is_file():
-                continue
-            try:
-                # Get relative path from THUMBNAILS_DIR
-                rel_thumb_path = p.relative_to(THUMBNAILS_DIR).as_posix()
-
-                # Check if this is a thumbnail file matching our pattern
-                # Pattern: thumb_{width}x{height}_{original_path}.webp
-                if rel_thumb_path.startswith("thumb_") and rel_thumb_path.endswith(".webp"):
-                    # Extract the path part after thumb_{width}x{height}_
-                    # Example: "thumb_150x150_testing/image.webp"
-                    parts = rel_thumb_path.split("_", 2)
-                    if len(parts) >= 3:
-                        # parts[0] = "thumb"
-                        # parts[1] = "150x150" (or similar)
-                        # parts[2] = "testing/image.webp"
-                        thumb_path_part = parts[2]
-
-                        # Remove .webp extension
-                        if thumb_path_part.endswith(".webp"):
-                            thumb_path_part = thumb_path_part[:-5]  # Remove .webp
-
-                        # Normalize both paths for comparison
-                        # Remove file extensions from both paths since thumbnail is always .webp
-                        thumb_path_normalized = thumb_path_part.strip("/")
-
-                        # Remove extension from decoded path for comparison
-                        decoded_path_obj = Path(rel_decoded_posix)
-                        decoded_path_normalized = (decoded_path_obj.parent / decoded_path_obj.stem).as_posix().strip("/")
-
-                        # Only delete if paths match exactly (ignoring file extensions)
-                        if thumb_path_normalized == decoded_path_normalized:
-                            parent_dir = p.parent
-                            p.unlink()
-                            deleted_cache += 1
-                            _prune_empty_parents(parent_dir, THUMBNAILS_DIR)
-            except (ValueError, Exception):
-                # Fallback: if path parsing fails, check if decoded path (without extension) appears in thumbnail path
-                try:
-                    decoded_path_obj = Path(rel_decoded_posix)
-                    decoded_path_no_ext = (decoded_path_obj.parent / decoded_path_obj.stem).as_posix()
-                    sp = p.as_posix()
-                    # Check if the path without extension matches
-                    if decoded_path_no_ext in sp and p.is_file():
-                        parent_dir = p.parent
-                        p.unlink()
-                        deleted_cache += 1
-                        _prune_empty_parents(parent_dir, THUMBNAILS_DIR)
-                except Exception:
-                    pass
-
-    except Exception:
-        pass
+    finally:
+        HOT_CACHE.invalidate(_original_rel_path(original_full_path))
 
     return {"message": "Delete successful", "deleted_cache_files": deleted_cache}
 
 # ---------------------------
 # List Files Endpoint (NEW)
 # ---------------------------
+def _encode_cursor(mtime: float, path: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([mtime, path]).encode()).decode()
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        mtime, path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(mtime), str(path)
+    except Exception:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+def _query_section(section: str, limit: int, offset: int, after: Optional[tuple]) -> tuple:
+    where = "section = ?" if section else "1 = 1"
+    params = [_section_of(f"{section}/")] if section else []
+    if "/" in section:
+        where += " AND path >= ? AND path < ?"
+        params += list(_path_prefix_range(section))
+
+    conn = _db()
+    total = conn.execute(f"SELECT COUNT(*) FROM assets WHERE {where}", params).fetchone()[0]
+
+    query = (
+        "SELECT *, (SELECT data FROM media_probes p"
+        " WHERE p.path = assets.path AND p.size = assets.size AND p.mtime = assets.mtime) AS probe"
+        f" FROM assets WHERE {where}"
+    )
+    if after is not None:
+        query += " AND (mtime < ? OR (mtime = ? AND path < ?))"
+        params += [after[0], after[0], after[1]]
+        offset = 0
+    query += " ORDER BY mtime DESC, path DESC LIMIT ? OFFSET ?"
+    rows = conn.execute(query, params + [limit, offset]).fetchall()
+    return rows, total
+
+def _file_info_from_row(row: sqlite3.Row, section: str) -> dict:
+    file_url_path = row["path"]
+    file_info = {
+        "name": row["name"],
+        "path": file_url_path[len(section) + 1:] if section else file_url_path,
+        "full_path": file_url_path,
+        "type": row["type"],
+        "size": row["size"],
+        "size_mb": round(row["size"] / (1024 * 1024), 2),
+        "size_kb": round(row["size"] / 1024, 2),
+        "created_time": row["ctime"],
+        "modified_time": row["mtime"],
+        "urls": _asset_urls(file_url_path, row["type"], row["sha256"])
+    }
+
+    # Add type-specific metadata
+    if row["type"] == "image":
+        if row["width"] is not None:
+            file_info["metadata"] = {
+                "width": row["width"],
+                "height": row["height"],
+                "format": row["format"],
+                "bands": row["bands"]
+            }
+        else:
+            file_info["metadata"] = {"error": "Could not read image metadata"}
+
+    elif row["type"] == "pdf":
+        if row["page_count"] is not None:
+            file_info["metadata"] = {
+                "page_count": row["page_count"],
+                "is_encrypted": bool(row["is_encrypted"])
+            }
+        else:
+            file_info["metadata"] = {"error": "Could not read PDF metadata"}
+
+    elif row["type"] == "video":
+        if row["probe"] is not None:
+            file_info["metadata"] = json.loads(row["probe"])
+        else:
+            file_info["metadata"] = {"error": "Could not read video metadata"}
+
+    return file_info
+
 @app.get("/list/{section:path}")
 async def list_files(
     section: str,
     api_key: str = Depends(verify_api_key),
     page: int = Query(1, ge=1, description="Page number"),
-    limit: int = Query(50, ge=1, le=100, description="Items per page")
+    limit: int = Query(50, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Keyset cursor (next_cursor of the previous page)")
 ):
     """
     List all files in a specific section with pagination and file metadata
     """
+    section = section.strip("/")
     section_dir = ORIGINALS_DIR / section
 
     if not section_dir.exists():
@@ -668,106 +3621,26 @@ async def list_files(
     if not _safe_within_base(section_dir):
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    try:
-        # Get all files recursively in the section
-        all_files = []
-        for file_path in section_dir.rglob("*"):
-            if file_path.is_file():
-                try:
-                    file_stats = file_path.stat()
-                    relative_path = file_path.relative_to(section_dir)
-
-                    # Get file type
-                    file_type = get_file_type(file_path.name)
-
-                    # Generate URLs
-                    file_url_path = f"{section}/{relative_path}"
-                    original_url = f"{VPS_BASE_URL}/originals/{quote(str(file_url_path))}"
-
-                    # Generate appropriate processed URLs based on file type
-                    if file_type == "image":
-                        processed_url = f"{VPS_BASE_URL}/process/300/300/{quote(str(file_url_path))}"
-                        thumbnail_url = f"{VPS_BASE_URL}/thumbnail/150/150/{quote(str(file_url_path))}"
-                    elif file_type == "video":
-                        processed_url = f"{VPS_BASE_URL}/process/video/thumbnail/300x300/{quote(str(file_url_path))}"
-                        thumbnail_url = f"{VPS_BASE_URL}/process/video/thumbnail/150x150/{quote(str(file_url_path))}"
-                    elif file_type == "pdf":
-                        processed_url = f"{VPS_BASE_URL}/process/pdf/thumbnail/300x300/{quote(str(file_url_path))}"
-                        thumbnail_url = f"{VPS_BASE_URL}/process/pdf/thumbnail/150x150/{quote(str(file_url_path))}"
-                    else:
-                        processed_url = original_url
-                        thumbnail_url = original_url
-
-                    file_info = {
-                        "name": file_path.name,
-                        "path": str(relative_path),
-                        "full_path": str(file_url_path),
-                        "type": file_type,
-                        "size": file_stats.st_size,
-                        "size_mb": round(file_stats.st_size / (1024 * 1024), 2),
-                        "size_kb": round(file_stats.st_size / 1024, 2),
-                        "created_time": file_stats.st_ctime,
-                        "modified_time": file_stats.st_mtime,
-                        "urls": {
-                            "original": original_url,
-                            "processed": processed_url,
-                            "thumbnail": thumbnail_url,
-                            "delete": f"{VPS_BASE_URL}/delete/{quote(str(file_url_path))}"
-                        }
-                    }
-
-                    # Add type-specific metadata
-                    if file_type == "image":
-                        try:
-                            image = pyvips.Image.new_from_file(str(file_path))
-                            file_info.update({
-                                "metadata": {
-                                    "width": image.width,
-                                    "height": image.height,
-                                    "format": image.format,
-                                    "bands": image.bands
-                                }
-                            })
-                        except Exception:
-                            file_info["metadata"] = {"error": "Could not read image metadata"}
-
-                    elif file_type == "pdf":
-                        try:
-                            pdf_document = fitz.open(str(file_path))
-                            file_info.update({
-                                "metadata": {
-                                    "page_count": len(pdf_document),
-                                    "is_encrypted": pdf_document.is_encrypted
-                                }
-                            })
-                            pdf_document.close()
-                        except Exception:
-                            file_info["metadata"] = {"error": "Could not read PDF metadata"}
-
-                    all_files.append(file_info)
-
-                except Exception as e:
-                    # Skip files that can't be processed but continue with others
-                    print(f"Error processing file {file_path}: {e}")
-                    continue
+    after = _decode_cursor(cursor) if cursor else None
 
-        # Sort files by modification time (newest first)
-        all_files.sort(key=lambda x: x["modified_time"], reverse=True)
+    try:
+        rows, total_files = await asyncio.to_thread(
+            _query_section, section, limit, (page - 1) * limit, after
+        )
+        files = [_file_info_from_row(row, section) for row in rows]
 
-        # Pagination
-        total_files = len(all_files)
-        total_pages = (total_files + limit - 1) // limit
-        start_idx = (page - 1) * limit
-        end_idx = start_idx + limit
-        paginated_files = all_files[start_idx:end_idx]
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = _encode_cursor(rows[-1]["mtime"], rows[-1]["path"])
 
         return {
             "section": section,
             "total_files": total_files,
-            "total_pages": total_pages,
+            "total_pages": (total_files + limit - 1) // limit,
             "current_page": page,
             "limit": limit,
-            "files": paginated_files
+            "next_cursor": next_cursor,
+            "files": files
         }
 
     except Exception as e:
@@ -777,20 +3650,24 @@ async def list_files(
 # ---------------------------
 # List Sections Endpoint (NEW)
 # ---------------------------
+def _section_totals() -> dict:
+    rows = _db().execute(
+        "SELECT section, COUNT(*) AS file_count, SUM(size) AS total_size FROM assets GROUP BY section"
+    ).fetchall()
+    return {row["section"]: (row["file_count"], row["total_size"] or 0) for row in rows}
+
 @app.get("/sections")
 async def list_sections(api_key: str = Depends(verify_api_key)):
     """
     List all available sections (subdirectories in originals)
     """
     try:
+        totals = await asyncio.to_thread(_section_totals)
+
         sections = []
         for item in ORIGINALS_DIR.iterdir():
-            if item.is_dir():
-                # Count files in section
-                file_count = sum(1 for _ in item.rglob("*") if _.is_file())
-
-                # Get section size
-                section_size = sum(f.stat().st_size for f in item.rglob("*") if f.is_file())
+            if item.is_dir() and not item.name.startswith("."):
+                file_count, section_size = totals.get(item.name, (0, 0))
 
                 sections.append({
                     "name": item.name,
@@ -822,5 +3699,6 @@ async def health_check():
             "images": list(SUPPORTED_IMAGE_FORMATS),
             "videos": list(SUPPORTED_VIDEO_FORMATS),
             "documents": list(SUPPORTED_DOCUMENT_FORMATS)
-        }
+        },
+        "render_pools": render_pool_stats()
     }
@@ -1,3 +1,9 @@
+# uvicorn workers share one port; keep upstream connections open
+upstream {{PROJECT}}_app {
+    server 127.0.0.1:{{PORT}};
+    keepalive 64;
+}
+
 server {
     server_name {{DOMAIN}};
 
@@ -29,8 +35,9 @@ server {
     # Health check
     # ---------------------------
     location /health {
-        proxy_pass http://127.0.0.1:{{PORT}};
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -41,8 +48,9 @@ server {
     # File info endpoint
     # ---------------------------
     location ^~ /info/ {
-        proxy_pass http://127.0.0.1:{{PORT}};
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -61,8 +69,9 @@ server {
             return 204;
         }
 
-        proxy_pass http://127.0.0.1:{{PORT}};
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -83,12 +92,45 @@ server {
             return 204;
         }
 
-        proxy_pass http://127.0.0.1:{{PORT}};
+        proxy_pass http://{{PROJECT}}_app;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+    }
+
+    # ---------------------------
+    # Cached derivatives
+    # ---------------------------
+    # Cache hits are sent straight from disk with sendfile, either via
+    # try_files below or when the app answers with X-Accel-Redirect.
+    # With CONTENT_ADDRESSED=1 or CACHE_LAYOUT=hashed derivatives are keyed by
+    # hash, so try_files misses and every hit takes the X-Accel-Redirect path.
+    # The app sends the same "<mtime>-<size>" ETag nginx does, so a validator
+    # from either path revalidates against the other. The ?v= on asset URLs is
+    # not part of the try_files lookup; it only busts browser and CDN caches.
+    location ^~ /_accel/ {
+        internal;
+        alias /var/www/images/{{PROJECT}}/;
+        expires 1y;
+        add_header Cache-Control "public, immutable";
+        # format=auto responses vary on Accept
+        add_header Vary $upstream_http_vary;
+        add_header Server-Timing $upstream_http_server_timing;
+    }
+
+    location @media_app {
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
         proxy_set_header X-Forwarded-Proto $scheme;
+        expires 1y;
+        add_header Cache-Control "public, immutable";
     }
 
     # ---------------------------
@@ -97,8 +139,16 @@ server {
     location ^~ /process/ {
 
         location ^~ /process/pdf/ {
-            proxy_pass http://127.0.0.1:{{PORT}};
+            location ~ ^/process/pdf/thumbnail/(\d+)x(\d+)/(.+)$ {
+                root /var/www/images/{{PROJECT}}/cache;
+                try_files /pdf_thumb/$1x$2/p$tixa_page/$3.jpg @media_app;
+                expires 1y;
+                add_header Cache-Control "public, immutable";
+            }
+
+            proxy_pass http://{{PROJECT}}_app;
             proxy_http_version 1.1;
+            proxy_set_header Connection "";
             proxy_set_header Host $host;
             proxy_set_header X-Real-IP $remote_addr;
             proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -108,8 +158,9 @@ server {
         }
 
         location ^~ /process/video/ {
-            proxy_pass http://127.0.0.1:{{PORT}};
+            proxy_pass http://{{PROJECT}}_app;
             proxy_http_version 1.1;
+            proxy_set_header Connection "";
             proxy_set_header Host $host;
             proxy_set_header X-Real-IP $remote_addr;
             proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -118,8 +169,16 @@ server {
             add_header Cache-Control "public, immutable";
         }
 
-        proxy_pass http://127.0.0.1:{{PORT}};
+        location ~ ^/process/(\d+)/(\d+)/(.+)$ {
+            root /var/www/images/{{PROJECT}}/cache;
+            try_files /process/$1x$2/q$tixa_quality/$tixa_format$tixa_fit_suffix/$3.$tixa_ext @media_app;
+            expires 1y;
+            add_header Cache-Control "public, immutable";
+        }
+
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -132,8 +191,32 @@ server {
     # Thumbnails
     # ---------------------------
     location ^~ /thumbnail/ {
-        proxy_pass http://127.0.0.1:{{PORT}};
+        location ~ ^/thumbnail/(\d+)/(\d+)/(.+)$ {
+            root /var/www/images/{{PROJECT}}/thumbnails;
+            try_files /$1x$2/q$tixa_quality/$3.$tixa_ext @media_app;
+            expires 1y;
+            add_header Cache-Control "public, immutable";
+        }
+
+        proxy_pass http://{{PROJECT}}_app;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        expires 1y;
+        add_header Cache-Control "public, immutable";
+    }
+
+    # ---------------------------
+    # Transform pipeline (?ops=...)
+    # ---------------------------
+    # Cache keys hash the ops, so hits come back from the app as X-Accel-Redirect
+    location ^~ /transform/ {
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
         proxy_set_header Host $host;
         proxy_set_header X-Real-IP $remote_addr;
         proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
@@ -142,6 +225,20 @@ server {
         add_header Cache-Control "public, immutable";
     }
 
+    # ---------------------------
+    # srcset manifests
+    # ---------------------------
+    # JSON only; the URLs it lists are /process/{w}/0 URLs served by try_files above
+    location ^~ /srcset/ {
+        proxy_pass http://{{PROJECT}}_app;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+    }
+
     # ---------------------------
     # List endpoints
     # ---------------------------
@@ -154,8 +251,9 @@ server {
             return 204;
         }
 
-        proxy_pass http://127.0.0.1:{{PORT}};
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
     }
 
     location ^~ /sections {
@@ -167,8 +265,56 @@ server {
             return 204;
         }
 
-        proxy_pass http://127.0.0.1:{{PORT}};
+        proxy_pass http://{{PROJECT}}_app;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+    }
+
+    # ---------------------------
+    # Job queue (submit, status, result)
+    # ---------------------------
+    location ^~ /jobs {
+        if ($request_method = OPTIONS) {
+            add_header Access-Control-Allow-Origin "*";
+            add_header Access-Control-Allow-Methods "GET, POST, OPTIONS";
+            add_header Access-Control-Allow-Headers "x-api-key, content-type";
+            add_header Access-Control-Max-Age 86400;
+            return 204;
+        }
+
+        proxy_pass http://{{PROJECT}}_app;
         proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+    }
+
+    # ---------------------------
+    # Metrics (local scrape only)
+    # ---------------------------
+    location = /metrics {
+        allow 127.0.0.1;
+        allow ::1;
+        deny all;
+        proxy_pass http://{{PROJECT}}_app;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+    }
+
+    # ---------------------------
+    # Admin endpoints (index, cache)
+    # ---------------------------
+    location ~ ^/(index|cache)/ {
+        proxy_pass http://{{PROJECT}}_app;
+        proxy_http_version 1.1;
+        proxy_set_header Connection "";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
     }
 
     # Block hidden files
@@ -10,7 +10,31 @@ Group=root
 WorkingDirectory=/opt/{{PROJECT}}-processor
 Environment=PATH=/opt/{{PROJECT}}-processor/venv/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin
 
-ExecStart=/opt/{{PROJECT}}-processor/venv/bin/uvicorn main:app --host 0.0.0.0 --port {{PORT}}
+# Concurrency (set by tixa create)
+Environment=WEB_WORKERS={{WORKERS}}
+Environment=RENDER_CONCURRENCY={{RENDER_CONCURRENCY}}
+Environment=UPLOAD_CONCURRENCY={{UPLOAD_CONCURRENCY}}
+
+# nginx sends cache hits itself (see /_accel/ in the site config)
+Environment=ACCEL_REDIRECT=1
+
+# Store identical uploads once and share their derivatives (see CONTENT_ADDRESSED in main.py)
+#Environment=CONTENT_ADDRESSED=1
+# File derivatives under <kind>/<aa>/<bb>/<spec hash> instead of URL-shaped paths
+#Environment=CACHE_LAYOUT=hashed
+# Serve repeat hits on small derivatives from memory (see HOT_CACHE_* in main.py)
+#Environment=HOT_CACHE_MAX_BYTES=64M
+
+# Admission control per worker (see RATE_LIMIT_* and ROUTE_CONCURRENCY in main.py).
+# Renders past RENDER_QUEUE_MAX waiting per pool (default 64) get 503 + Retry-After.
+#Environment=RATE_LIMIT_PER_IP=20/40
+#Environment=ROUTE_CONCURRENCY=upload=8,transform=16
+
+# /metrics aggregates all workers through files here; systemd recreates it empty on start
+RuntimeDirectory={{PROJECT}}-metrics
+Environment=PROMETHEUS_MULTIPROC_DIR=/run/{{PROJECT}}-metrics
+
+ExecStart=/opt/{{PROJECT}}-processor/venv/bin/uvicorn main:app --host 0.0.0.0 --port {{PORT}} --workers {{WORKERS}} --timeout-keep-alive 75
 
 Restart=always
 RestartSec=5